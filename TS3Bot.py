@@ -1,33 +1,49 @@
+import asyncio
+import contextvars
 import re
+import threading
 import time
 import traceback
-from typing import Union,List,Dict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Union,List,Dict,Tuple
 
 import ts3
-from ts3.query import TS3Connection, TS3TimeoutError
+from ts3.query import TS3TimeoutError
 from ts3.response import TS3Event
 
 from apis.audioBotApi.AudioBotApi import AudioBotApi
+from apis.audioBotApi.data import PlaybackState
 from apis.chatApi.ChatApi import ChatApi
 from apis.muiscApi.MusicApi import MusicApi
 from apis.muiscApi.data import Song, PlayList
+from apis.muiscApi.router import MusicApiRouter
 from apis.neteaseApi.NeteaseApi import NeteaseApi
 from apis.petApi.Pet import PetInfo
 from apis.petApi.PetApi import PetApi, BattleResult
 from apis.ttsApi.TTSApi import TTSApi
+from data_structures.AliasTrie import AliasTrie
 from data_structures.Command import Command
 from data_structures.Sender import Sender
+from utils.audio_cache import AudioCache
+from utils.connection import LockedConnection
+from utils.cover_cache import CoverCache
 from utils.logger import init_logger
+from utils.outbox import Outbox
+from utils.pager import PageView, Pager
+from utils.prompt import Prompt, PromptRegistry
+from utils.scheduler import TrackEndScheduler
+from utils.worker import KeyedWorkerPool
 
 my_commands = [{'command': 'play_id', 'alias': ["播放ID"], 'help': '添加对应ID歌曲到当前歌单并播放',
-              'examples': ["播放ID789798"]},
+              'examples': ["播放ID789798"], 'slow': True},
              {'command': 'add_id', 'alias': ["添加ID"], 'help': '添加对应ID歌曲到当前歌单',
-              'examples': ["添加ID123456"]},
+              'examples': ["添加ID123456"], 'slow': True},
              {'command': 'play', 'alias': ["我想听", "我要听"], 'help': '自动搜索歌曲并添加到当前歌单',
-              'examples': ["我想听爱情转移", "我要听爱情转移"]},
+              'examples': ["我想听爱情转移", "我要听爱情转移"], 'slow': True},
              {'command': 'help', 'alias': ["帮助", "怎么玩"], 'help': '显示帮助手册'},
-             {'command': 'chat', 'alias': ["聊天"], 'help': '喵~~'},
-             {'command': 'search', 'alias': ["搜索"], 'help': '搜索曲库歌曲', 'examples': ["搜索爱情转移"]},
+             {'command': 'chat', 'alias': ["聊天"], 'help': '喵~~', 'slow': True},
+             {'command': 'search', 'alias': ["搜索"], 'help': '搜索曲库歌曲', 'examples': ["搜索爱情转移"], 'slow': True},
+             {'command': 'search_all', 'alias': ["全网搜索"], 'help': '同时搜索所有曲库', 'examples': ["全网搜索爱情转移"], 'slow': True},
              {'command': 'pause', 'alias': ["暂停"], 'help': '暂停'},
              {'command': 'jump', 'alias': ["跳转"], 'help': '跳转到第N首歌曲', 'examples': ["跳转50"]},
              {'command': 'volume', 'alias': ["音量"], 'help': '调节音量。', 'examples': ["音量50"]},
@@ -38,19 +54,23 @@ my_commands = [{'command': 'play_id', 'alias': ["播放ID"], 'help': '添加对
              {'command': 'remove_item_list', 'alias': ["删除歌曲", "歌单删除"], 'help': '删除对应歌单ID的第x首歌',
               'examples': ["歌单删除1 12"]},
              {'command': 'add_item_list', 'alias': ["歌单添加"], 'help': '给对应歌单ID添加歌曲',
-              'examples': ["歌单添加0 爱情转移，天天"]},
+              'examples': ["歌单添加0 爱情转移，天天"], 'slow': True},
              {'command': 'add_id_item_list', 'alias': ["歌单添加ID"], 'help': '给对应歌单ID添加歌曲ID',
-              'examples': ["歌单添加0 11321,3213213"]},
-             {'command': 'show_list', 'alias': ["当前歌单", "歌单", "查看歌单"], 'help': '查看当前歌单或其他歌单',
-              'examples': ["当前歌单", "歌单[歌单ID]", "歌单123", "查看歌单789"]},
+              'examples': ["歌单添加0 11321,3213213"], 'slow': True},
+             {'command': 'show_current', 'alias': ["当前歌单"], 'help': '查看当前歌单，可以跟上页码',
+              'examples': ["当前歌单", "当前歌单 3"]},
+             {'command': 'show_list', 'alias': ["歌单", "查看歌单"], 'help': '查看当前歌单或其他歌单，可以在歌单ID后跟上页码',
+              'examples': ["歌单[歌单ID]", "歌单123", "查看歌单789 2"]},
              {'command': 'list_list', 'alias': ["所有歌单"], 'help': '查看所有歌单'},
+             {'command': 'next_page', 'alias': ["下一页"], 'help': '查看上一次列表的下一页'},
+             {'command': 'previous_page', 'alias': ["上一页"], 'help': '查看上一次列表的上一页'},
              {'command': 'play_list', 'alias': ["播放歌单"], 'help': '播放对应歌单ID', 'examples': ["播放歌单123"]},
              {'command': 'delete_list', 'alias': ["删除歌单"], 'help': '删除对应歌单ID', 'examples': ["删除歌单13456"]},
              {'command': 'save_current_list', 'alias': ["保存歌单"], 'help': '保存当前播放歌单到新歌单'},
              {'command': 'add', 'alias': ["添加"], 'help': '自动搜索歌曲并添加到当前歌单',
-              'examples': ["添加Lemon"]},
+              'examples': ["添加Lemon"], 'slow': True},
              {'command': 'play', 'alias': ["播放"], 'help': '自动搜索歌曲并插入到当前歌单并播放',
-              'examples': ["播放Lemon"]},
+              'examples': ["播放Lemon"], 'slow': True},
              {'command': 'remove_item_current', 'alias': ["删除"], 'help': '删除当前的第x首歌',
               'examples': ["删除 12"]},
              {'command': 'pet_new', 'alias': ["创建宠物", "新建宠物"], 'help': '新建一只宠物。',
@@ -62,16 +82,21 @@ my_commands = [{'command': 'play_id', 'alias': ["播放ID"], 'help': '添加对
               'examples': ["喂食", "喂食宠物", "喂宠物"]},
              {'command': 'pet_battle_add', 'alias': ["加入战斗"], 'help': '宠物加入战斗。'},
              {'command': 'pet_battle_list', 'alias': ["查看战斗", "战斗"], 'help': '宠物战斗。'},
-             {'command': 'pet_battle_start', 'alias': ["开始战斗"], 'help': '宠物开始战斗。'},
+             {'command': 'pet_battle_start', 'alias': ["开始战斗"], 'help': '宠物开始战斗。', 'slow': True},
              {'command': 'checkin', 'alias': ["签到"], 'help': '签到。'},
-             {'command': 'broadcast', 'alias': ["广播"], 'help': '广播。', 'examples': ["广播你好"]},
-             {'command': 'update_apis', 'alias': ["刷新接口"], 'help': '刷新接口状态。'},
+             {'command': 'broadcast', 'alias': ["广播"], 'help': '广播。', 'examples': ["广播你好"], 'slow': True},
+             {'command': 'update_apis', 'alias': ["刷新接口"], 'help': '刷新接口状态。', 'slow': True},
              {'command': 'show_apis', 'alias': ["接口"], 'help': '查看接口状态。'},
+             {'command': 'show_cache', 'alias': ["缓存"], 'help': '查看本地缓存状态。'},
              {'command': 'set_priority', 'alias': ["修改接口"], 'help': '修改接口优先级。',
               'examples': ["修改接口 default 50"]}
              ]
 
 
+# 并发执行指令时，每条指令回复到各自消息的来源。
+reply_targetmode = contextvars.ContextVar('reply_targetmode', default=None)
+
+
 class TS3Bot:
     def __init__(self, username, password, bot_api, host, port=10011, nickname="mew~", api: MusicApi = None):
         self.username = username
@@ -83,6 +108,8 @@ class TS3Bot:
         # music_apis用于多api管理。
         self.music_apis: dict = {}
         self.current_music_api = 0
+        # 曲库查询经过路由，当前接口出错时同一请求自动切到其他接口；歌单仍由music_api管理。
+        self.router = MusicApiRouter(self.music_apis, current=lambda: self.music_api)
         self.bot_api = bot_api
         self.audio_bot_api = AudioBotApi(bot_api)
         response = self.audio_bot_api.get_uid()
@@ -94,24 +121,61 @@ class TS3Bot:
         self.pet_api: Union[PetApi, None] = None
         self.netease_api: Union[NeteaseApi, None] = None
         self.tts_api: Union[TTSApi, None] = None
-        self.conn: Union[TS3Connection, None] = None
+        self.conn: Union[LockedConnection, None] = None
         self.chat_enable = False
         self.ignore_users = ['serveradmin', 'ServerQuery', self.audio_bot_uid]
         self.sid = 1  # server id
         self.cid = 1  # channel id
+        self.clid = None  # 自身的client id
+        self.audio_bot_clid = None
+        self.audio_bot_cid = None
+        self.follow_interval = 60  # 跟随音乐机器人主要依靠移动事件，轮询仅作为兜底
+        self.last_follow = 0
         self.targetmode = 3  # 消息发送模式
+        self.pager = Pager(page_size=20)  # 歌单、搜索结果分页显示，记录每个用户看到的页码
+        self.outbox = Outbox(self.deliver, on_error=self.on_send_error)  # 消息由后台线程切分、合并、限速后发送
         self.interval = 3  # listen间隔不要过短，过短会导致跳歌等情况
         self.timeout = 60 # 超时处理阈值，不一定是严格60秒。
+        self.health_timeout = 5  # 接口探测的总时限，所有接口共用
+        self.search_timeout = 5  # 全网搜索的时限，超时的曲库结果会被丢弃
+        self.bulk_concurrency = 4  # 批量添加时同时进行的搜索数
+        self.id_batch_size = 20  # 按ID添加时每次get_songs请求的ID数
+        self.scheduler = TrackEndScheduler(min_interval=self.interval)  # 根据歌曲剩余时间安排update，空闲时低频轮询
         self.previous_link = None
         self.prefix = "cmd_"
         self.hello = "Bot已上线。"
         self.logger = init_logger("TS3Bot")
         self.commands:List[Command] = []
+        self.command_trie = AliasTrie()  # alias -> (Command, 处理函数)
+        self.async_mode = False
+        self.playback_lock = threading.RLock()  # update和切歌指令互斥
+        self.last_command_time = 0
+        self.prompts = PromptRegistry()  # 等待用户回复的提问
+        # 预取的下一首歌曲的链接和封面 {"song_id", "link", "avatar"}，歌单顺序变化时作废
+        self.prefetched: Union[Dict, None] = None
+        self.prefetch_generation = 0
+        self.prefetch_lock = threading.Lock()
+        self.skip_queued = False  # 点歌时跳过已在歌单中和本次重复的歌曲，关闭时只提示
+        self.gapless = False  # 无缝播放：提前把下一首加入AudioBot的播放队列，由AudioBot直接切歌
+        self.audio_cache: Union[AudioCache, None] = None  # 设置后歌曲会缓存到本地，再次播放时由本地地址提供给AudioBot
+        self.cover_cache: Union[CoverCache, None] = None  # 设置后封面缩放后缓存到本地
+        self.bot_description = None  # 上一次设置的描述和头像，没变化时不再设置
+        self.bot_avatar_key = None
+        self.playing_link = None  # 最近一次交给AudioBot播放的链接
+        self.queued_next: Union[Dict, None] = None  # 已加入AudioBot队列的下一首 {"song_id", "link"}
+        self.workers = KeyedWorkerPool(max_workers=4, on_error=self.on_worker_error)
 
     def wait_event(self, timeout: int = 10):
-        """ 等待事件 """
+        """ 等待消息事件，期间收到的移动等事件直接处理 """
+        time_end = time.time() + timeout
         while True:
-            event = self.conn.wait_for_event(timeout=timeout)
+            remaining = time_end - time.time()
+            if remaining <= 0:
+                raise TS3TimeoutError()
+            event = self.conn.wait_for_event(timeout=remaining)
+            if event.event != 'notifytextmessage':
+                self.on_event(event)
+                continue
             try:
                 parsed_event = event.parsed[0]
                 sender_uid = parsed_event['invokeruid']
@@ -120,23 +184,62 @@ class TS3Bot:
             except KeyError as e:
                 pass
 
+    def on_event(self, event: TS3Event):
+        """ 处理频道相关事件，音乐机器人移动时才跟随。多个客户端的事件会合并为一条，逐条处理 """
+        # 合并的移动事件中ctid等公共字段只出现在第一条
+        shared = event.parsed[0] if event.parsed and event.event == 'notifyclientmoved' else {}
+        for parsed_event in event.parsed:
+            try:
+                self.on_client_event(event.event, {**shared, **parsed_event})
+            except KeyError:
+                pass
+        return
+
+    def on_client_event(self, event_type: str, parsed_event: dict):
+        if event_type == 'notifyclientmoved':
+            clid = str(parsed_event['clid'])
+            if clid == str(self.audio_bot_clid):
+                self.audio_bot_api.invalidate_bot_info()
+                self.audio_bot_cid = parsed_event['ctid']
+                self.move_to(self.audio_bot_cid)
+            elif clid == str(self.clid):
+                self.cid = parsed_event['ctid']
+                if self.audio_bot_cid is not None:
+                    self.move_to(self.audio_bot_cid)
+        elif event_type == 'notifycliententerview':
+            if parsed_event.get('client_unique_identifier') == self.audio_bot_uid:
+                self.audio_bot_api.invalidate_bot_info()
+                self.audio_bot_clid = parsed_event['clid']
+                self.audio_bot_cid = parsed_event['ctid']
+                self.move_to(self.audio_bot_cid)
+        elif event_type == 'notifyclientleftview':
+            if str(parsed_event['clid']) == str(self.audio_bot_clid):
+                self.audio_bot_api.invalidate_bot_info()
+                self.audio_bot_clid = None
+                self.audio_bot_cid = None
+
     def connect(self):
         self.logger.info("Server query connecting...")
         # 连接并做初始设置。
-        if self.conn is None:
-            self.conn = ts3.query.TS3Connection(self.host, self.port)
-        else:
+        if self.conn is not None:
             self.conn.close()
-            self.conn = ts3.query.TS3Connection(self.host, self.port)
+        self.conn = LockedConnection(ts3.query.TS3Connection(self.host, self.port))
         self.conn.login(client_login_name=self.username, client_login_password=self.password)
         self.conn.use(sid=1)
         self.conn.clientupdate(client_nickname=self.nickname)
         self.conn.send_keepalive()
         self.conn.servernotifyregister(event='textserver')
         self.conn.servernotifyregister(event='textchannel')
+        self.conn.servernotifyregister(event='channel', id=0)  # 所有频道的进出和移动事件
         self.logger.info("Broadcast hello message.")
         self.conn.gm(msg=self.hello)
         self.audio_bot_api.clear() # 是否需要上线清空歌单
+        try:
+            self.follow()
+        except Exception:
+            # AudioBot可能还没上线，交给listen的第一次循环重试
+            self.last_follow = 0
+            self.logger.warning(f"Follow failed: {traceback.format_exc()}")
         return
 
     def run(self):
@@ -148,8 +251,19 @@ class TS3Bot:
         self.logger.info('Updated music api.')
         self.listen()
 
+    def run_async(self):
+        """ asyncio模式：事件读取、播放维护和指令执行互不阻塞 """
+        if self.music_api:
+            self.register_music_api(self.music_api, "default")
+        self.connect()
+        self.logger.info('Connected.')
+        self.update_music_api()
+        self.logger.info('Updated music api.')
+        asyncio.run(self.listen_async())
+
     def register_music_api(self, music_api: MusicApi, api_id: str, priority: int = 100):
-        api_info = {"api": music_api, "id": api_id, "priority": priority, "accessibility": False}
+        api_info = {"api": music_api, "id": api_id, "priority": priority, "accessibility": False, "latency": None}
+        music_api.api_id = api_id
         self.music_apis[api_id] = api_info
         self.logger.info(f"Register music api id: {api_id} priority: {priority}")
 
@@ -160,19 +274,43 @@ class TS3Bot:
             _commands = commands
         for cmd in _commands:
             if isinstance(cmd,dict):
-                self.commands.append(Command(**cmd))
-            if isinstance(cmd, Command):
-                self.commands.append(cmd)
+                cmd = Command(**cmd)
+            if not isinstance(cmd, Command):
+                continue
+            self.commands.append(cmd)
+            # 注册时就解析出处理函数，收到消息后只需要查前缀树。
+            try:
+                func = self.__getattribute__(f"{self.prefix}{cmd.command}")
+            except AttributeError:
+                self.logger.warning(f"Command function not found: {self.prefix}{cmd.command}")
+                continue
+            for alias in cmd.alias:
+                if not self.command_trie.insert(alias, (cmd, func)):
+                    self.logger.warning(f"Duplicated alias: {alias}, command: {cmd.command}")
         return
 
     def check_apis_access(self):
-        for api_id, api_info in self.music_apis.items():
-            api: MusicApi = api_info['api']
-            response = api.available()
-            if not response.succeed:
-                self.music_apis[api_id]['accessibility'] = False
-            else:
-                self.music_apis[api_id]['accessibility'] = True
+        """ 并发探测所有接口，超过health_timeout仍未返回的视为不可用 """
+        if not self.music_apis:
+            return
+        def probe(api: MusicApi):
+            start = time.time()
+            response = api.health(timeout=self.health_timeout)
+            return response, time.time() - start
+        executor = ThreadPoolExecutor(max_workers=len(self.music_apis), thread_name_prefix="health")
+        futures = {api_id: executor.submit(probe, api_info['api']) for api_id, api_info in self.music_apis.items()}
+        wait(futures.values(), timeout=self.health_timeout)
+        # 不等待超时的探测结束，它们会在后台自行退出
+        executor.shutdown(wait=False)
+        for api_id, future in futures.items():
+            api_info = self.music_apis[api_id]
+            if not future.done() or future.exception() is not None:
+                api_info['accessibility'] = False
+                api_info['latency'] = None
+                continue
+            response, latency = future.result()
+            api_info['accessibility'] = response.succeed
+            api_info['latency'] = latency
         return
 
     def update_music_api(self):
@@ -195,13 +333,16 @@ class TS3Bot:
         while True:
             self.conn.send_keepalive()
             try:
-                self.follow()
-                event = self.wait_event(timeout=self.interval)
+                if time.time() - self.last_follow > self.follow_interval:
+                    self.follow()
+                event = self.wait_event(timeout=self.next_wait())
                 time_start = time.time()  # 一旦有消息则重置
                 self.handle(event)
             except TS3TimeoutError:
                 # update容易和handle冲突，比如当某首歌跳转之后但还没切换过来（因为AudioBot有一定的延迟），但是碰到update发现Bot处于未播放，于是切成下一首导致跳歌。所以把update安排在这，保证update调用之间一定有空隙。
-                self.update()
+                # 后台线程中的指令也可能刚刚切过歌，同样留出空隙。
+                if self.update_due():
+                    self.update()
             except Exception as e:
                 self.logger.error("Listen error: ", traceback.format_exc())
                 pass
@@ -209,87 +350,308 @@ class TS3Bot:
                 time_start = time.time()
                 self.standby()
 
+    async def listen_async(self):
+        # 各api仍是同步客户端，阻塞的调用通过asyncio.to_thread在线程池中执行
+        if self.conn is None:
+            return
+        self.async_mode = True
+        self.logger.info("Start listening (async).")
+        self.last_command_time = time.time()
+        # 指令提前了查询时间时唤醒upkeep，poke可能来自工作线程
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.scheduler.on_poke = lambda: loop.call_soon_threadsafe(wakeup.set)
+        try:
+            await asyncio.gather(self.read_events_async(), self.upkeep_async(wakeup))
+        finally:
+            self.scheduler.on_poke = None
+
+    async def read_events_async(self):
+        """ 读取消息事件，每条指令在独立的task中执行 """
+        tasks = set()
+        while True:
+            try:
+                event = await asyncio.to_thread(self.wait_event, self.interval)
+            except TS3TimeoutError:
+                continue
+            except Exception:
+                self.logger.error(f"Listen error: {traceback.format_exc()}")
+                await asyncio.sleep(self.interval)
+                continue
+            task = asyncio.create_task(self.handle_async(event))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def upkeep_async(self, wakeup: asyncio.Event):
+        """ 保活、跟随兜底、播放维护和空闲处理，不受指令执行影响，scheduler被poke时提前醒来 """
+        time_start = time.time()
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=self.next_wait())
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            try:
+                await asyncio.to_thread(self.conn.send_keepalive)
+                if time.time() - self.last_follow > self.follow_interval:
+                    await asyncio.to_thread(self.follow)
+                # 与同步模式一致，刚执行过指令时跳过一次update，避免AudioBot延迟导致跳歌。
+                if self.update_due():
+                    await asyncio.to_thread(self.update)
+                if self.last_command_time > time_start:
+                    time_start = self.last_command_time
+                if time.time() - time_start > self.timeout:
+                    time_start = time.time()
+                    await asyncio.to_thread(self.standby)
+            except Exception:
+                self.logger.error(f"Upkeep error: {traceback.format_exc()}")
+
+    def update_due(self) -> bool:
+        """ 到了安排的时间，并且距离上一条指令留出了空隙 """
+        return self.scheduler.due() and time.time() - self.last_command_time >= self.interval
+
+    def next_wait(self) -> float:
+        """ 距离下一次update的等待时间，最长不超过scheduler.max_interval以保证保活和空闲处理 """
+        wake = max(self.scheduler.next_poll, self.last_command_time + self.interval)
+        return min(max(wake - time.time(), 0.1), self.scheduler.max_interval)
+
     def follow(self):
         """
         为了接收到和音乐机器人同一频道下的消息，需要跟随音乐机器人移动
+        平时由on_event根据移动事件跟随，这里的轮询只是兜底。
         :return:
         """
+        self.last_follow = time.time()
         res = self.conn.clientgetids(cluid=self.audio_bot_uid)
         if not res[0]:
+            self.audio_bot_api.invalidate_bot_info()
+            self.audio_bot_clid = None
             raise Exception('AudioBotNotFound.')
+        self.audio_bot_clid = res[0]['clid']
         response = self.audio_bot_api.get_cid()
         if not response.succeed:
             return
-        audio_bot_cid = response.data
+        self.audio_bot_cid = response.data
         try:
             res = self.conn.whoami()
-            bot_clid = res[0]['client_id']
-            bot_cid = res[0]['client_channel_id']
+            self.clid = res[0]['client_id']
+            self.cid = res[0]['client_channel_id']
         except Exception:
             return
-        self.cid = bot_cid
-        if str(bot_cid) != str(audio_bot_cid):
-            self.conn.clientmove(cid=audio_bot_cid, clid=bot_clid)
-            self.logger.info(f"Client moved to cid:{audio_bot_cid}.")
+        self.move_to(self.audio_bot_cid)
+        return
+
+    def move_to(self, cid):
+        if str(self.cid) == str(cid):
+            return
+        self.conn.clientmove(cid=cid, clid=self.clid)
+        self.cid = cid
+        self.logger.info(f"Client moved to cid:{cid}.")
         return
 
-    def play_now(self):
+    def play_now(self) -> bool:
         # 获取api中的now，并播放，尽可能少用，因为该操作会中止当前播放，而audiobot多次play容易出现阻塞。
-        response = self.music_api.now()
+        # 返回是否开始播放
+        with self.playback_lock:
+            response = self.music_api.now()
+            if not response.succeed:
+                return False
+            song = response.data
+            # =========================================
+            # 获取link，优先使用预取的结果
+            link = self.take_prefetched(song, 'link')
+            if link is None:
+                response = self.router.get_song_link(song.id, source=song.source)
+                if not response.succeed:
+                    return False
+                link = response.data
+            link = self.local_link(song, link)
+            # =========================================
+            response = self.start_link(link)
+            if not response.succeed:
+                self.logger.info(f"Play_now failed link: {link}")
+                self.error(response.reason)
+                return False
+        self.schedule_prefetch()
+        return True
+
+    def start_link(self, link: str):
+        if self.gapless:
+            # play会打断当前歌曲，AudioBot队列里预排的下一首也随之作废
+            self.audio_bot_api.clear()
+            self.queued_next = None
+        response = self.audio_bot_api.play(link)
+        if response.succeed:
+            self.playing_link = link
+        return response
+
+    def schedule_prefetch(self):
+        """ 当前歌曲开始播放后，在后台解析下一首的链接和封面，切歌时不用再等待远端接口 """
+        with self.prefetch_lock:
+            self.prefetch_generation += 1
+            generation = self.prefetch_generation
+        self.workers.submit('prefetch', self.prefetch_next, generation)
+
+    def prefetch_next(self, generation: int):
+        response = self.music_api.peek_next()
         if not response.succeed:
             return
-        song = response.data
-        # =========================================
-        # 获取link
-        response = self.music_api.get_song_link(song.id)
+        song: Song = response.data
+        response = self.router.get_song_link(song.id, source=song.source)
         if not response.succeed:
             return
         link = response.data
-        # =========================================
-        response = self.audio_bot_api.play(link)
-        if not response.succeed:
-            self.logger.info(f"Play_now failed link: {link}")
-            self.error(response.reason)
-        return
+        response = self.router.get_avatar_link(song.id, source=song.source)
+        avatar = response.data if response.succeed else None
+        with self.prefetch_lock:
+            # 预取期间歌单顺序变了则丢弃
+            if generation != self.prefetch_generation:
+                return
+            self.prefetched = {"song_id": song.id, "link": link, "avatar": avatar}
+        self.logger.debug(f"Prefetched {song.id}.")
+        if self.gapless:
+            self.queue_next(generation, song, self.local_link(song, link))
+        elif self.audio_cache is not None:
+            self.audio_cache.prefetch(self.song_key(song), link)
+        if self.cover_cache is not None:
+            self.cover_cache.fetch(self.song_key(song), avatar)
+
+    def song_key(self, song: Song) -> str:
+        """ 缓存用的歌曲标识，同一曲库的接口共用 """
+        api_info = self.music_apis.get(song.source)
+        catalog = api_info['api'].catalog if api_info else self.music_api.catalog
+        return f"{catalog}:{song.id}"
+
+    def local_link(self, song: Song, link: str) -> str:
+        """ 本地缓存命中时返回本地地址，否则返回原链接并在后台缓存 """
+        if self.audio_cache is None or not link:
+            return link
+        return self.audio_cache.lookup(self.song_key(song), link) or link
+
+    def queue_next(self, generation: int, song: Song, link: str):
+        """ 把下一首加入AudioBot的队列，当前歌曲结束后AudioBot会立即切过去 """
+        with self.playback_lock:
+            # 同一链接连续播放时无法区分是否已切歌，交给轮询处理
+            if generation != self.prefetch_generation or link == self.playing_link:
+                return
+            response = self.audio_bot_api.add(link)
+            if not response.succeed:
+                self.logger.info(f"Queue next failed link: {link}")
+                return
+            self.queued_next = {"song_id": song.id, "link": link}
 
-    def update_play(self):
-        response = self.audio_bot_api.is_playing()
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        is_playing = response.data
-        if not is_playing:
-            self.music_api.next()
-            self.play_now()
-        return
+    def sync_gapless(self, state: PlaybackState) -> bool:
+        """ AudioBot已经自动播放到预排的下一首时，同步歌单位置并预排再下一首 """
+        queued = self.queued_next
+        if not self.gapless or queued is None or not state.playing or state.link != queued['link']:
+            return False
+        self.queued_next = None
+        self.playing_link = state.link
+        # 以AudioBot实际播放的歌曲为准同步位置，预排之后歌单可能已经改变
+        self.sync_cursor(queued['song_id'])
+        self.schedule_prefetch()
+        return True
 
-    def update_info(self):
-        response = self.audio_bot_api.get_song()
-        if not response.succeed:
+    def sync_cursor(self, song_id: str):
+        """ 把当前位置移到song_id在当前位置之后最近的一次出现 """
+        response = self.music_api.list_positions(self.music_api.current_list_id, song_id)
+        if not response.succeed or not response.data:
+            self.logger.warning(f"Gapless song {song_id} is no longer in the current list.")
+            return
+        count = len(self.music_api.current_show().data.songs)
+        current = self.music_api.current_index
+        index = min(response.data, key=lambda position: (position - current - 1) % count)
+        self.music_api.jump(index)
+
+    def take_prefetched(self, song: Song, key: str):
+        """ 取出预取的结果，歌曲不一致时返回None """
+        with self.prefetch_lock:
+            if self.prefetched is None or self.prefetched['song_id'] != song.id:
+                return None
+            return self.prefetched.pop(key, None)
+
+    def check_next_changed(self, previous_next):
+        """ 当前歌单修改后下一首变了（比如在最后一首时添加），需要重新预取和预排 """
+        response = self.music_api.peek_next()
+        previous_id = previous_next.data.id if previous_next.succeed else None
+        current_id = response.data.id if response.succeed else None
+        if previous_id != current_id:
+            self.drop_prefetch()
+
+    def drop_prefetch(self):
+        with self.prefetch_lock:
+            self.prefetch_generation += 1
+            self.prefetched = None
+        if self.gapless:
+            with self.playback_lock:
+                if self.queued_next is not None:
+                    self.audio_bot_api.clear()
+                    self.queued_next = None
+            self.schedule_prefetch()
+
+    def update_play(self, state: PlaybackState) -> bool:
+        """ 当前歌曲播放结束时切到下一首，返回是否开始播放了下一首，歌单为空或播放失败时为False """
+        if state.playing:
+            return False
+        if not self.music_api.next().succeed:
+            return False
+        return self.play_now()
+
+    def update_info(self, state: PlaybackState):
+        if not state.playing:
             return
-        link = response.data['Link']
+        link = state.link
         if self.previous_link == link:
             return
         response = self.music_api.now()
         if not response.succeed:
             return
         song: Song = response.data
-        response = self.music_api.get_avatar_link(song.id)
-        if response.succeed:
-            avatar = response.data
-        else:
-            avatar = ''
+        avatar = self.take_prefetched(song, 'avatar')
+        if avatar is None:
+            response = self.router.get_avatar_link(song.id, source=song.source)
+            if response.succeed:
+                avatar = response.data
+            else:
+                avatar = ''
         singers = ' '.join(singer.name for singer in song.singers)
-        self.audio_bot_api.set_bot_description(f"！！正在播放来自{singers}的{song.name}")
-        self.audio_bot_api.set_bot_avatar(avatar)
+        self.set_bot_info(f"！！正在播放来自{singers}的{song.name}", avatar, song)
         self.previous_link = link
 
+    def set_bot_info(self, description: str, avatar: str, song: Song):
+        """ 只在内容变化时设置描述和头像，开启封面缓存时按图片哈希判断，封面未缓存时先用远端链接 """
+        if description != self.bot_description:
+            if self.audio_bot_api.set_bot_description(description).succeed:
+                self.bot_description = description
+        avatar_key = avatar
+        if self.cover_cache is not None and avatar:
+            cached = self.cover_cache.get(self.song_key(song), avatar)
+            if cached is not None:
+                avatar, avatar_key = cached
+        if avatar_key != self.bot_avatar_key:
+            if self.audio_bot_api.set_bot_avatar(avatar).succeed:
+                self.bot_avatar_key = avatar_key
+
     def update(self):
         """用于更新AudioBot的歌曲信息"""
         if not self.music_api:
+            self.scheduler.schedule(None)
             return
-        self.update_play()
-        self.update_info()
+        with self.playback_lock:
+            # 每次update只请求一次播放状态，切歌和歌曲信息更新共用。
+            response = self.audio_bot_api.get_playback_state()
+            if not response.succeed:
+                self.scheduler.schedule(None)
+                self.error(response.reason)
+                return
+            state: PlaybackState = response.data
+            self.scheduler.schedule(state)
+            self.sync_gapless(state)
+            if self.update_play(state):
+                # 刚切歌，状态已过期，歌曲信息留到下一次update更新。
+                self.scheduler.poke()
+                return
+            self.update_info(state)
 
     def standby(self):
         # 长时间未操作进入standby状态
@@ -299,38 +661,83 @@ class TS3Bot:
             self.send("那我先下线了喵~~")
         return
 
-    def handle(self, event: TS3Event):
+    def parse_command(self, event: TS3Event):
+        """ 解析消息事件，返回(处理函数, sender, args, 是否耗时) """
         parsed_event = event.parsed[0]
         self.logger.info(f"Received event: {parsed_event}")
         sender_name = parsed_event['invokername']
         sender_uid = parsed_event['invokeruid']
         self.targetmode = parsed_event['targetmode']
+        reply_targetmode.set(parsed_event['targetmode'])
         sender = Sender(sender_name=sender_name, sender_uid=sender_uid)
         message: str = parsed_event['msg']
-        command = None
-        alias = None
-        for cmd_command in self.commands:
-            for cmd_alias in cmd_command.alias:
-                if message.startswith(cmd_alias):
-                    command = cmd_command.command
-                    alias = cmd_alias
-                    break
-            if command is not None:
-                break
-        if command is None:
-            self.default(sender, message)
-        else:
-            args = message.strip(alias).strip().split(' ')
-            try:
-                func = self.__getattribute__(f"{self.prefix}{command}")
-            except AttributeError:
+        # 最长匹配，比如“播放ID”不会被“播放”抢先匹配
+        match = self.command_trie.longest_prefix(message)
+        if match is None:
+            # 聊天模式下默认消息会交给聊天api
+            return self.default, sender, [message], self.chat_enable
+        alias, (command, func) = match
+        args = message[len(alias):].strip().split(' ')
+        self.logger.info(f"Exec cmd_function: {func.__name__}, sender: {sender}, args: {args}.")
+        return func, sender, args, command.slow
+
+    def take_prompt(self, event: TS3Event):
+        """ 如果发送者有等待回复的提问，返回(回调, sender, [回复], 是否耗时) """
+        parsed_event = event.parsed[0]
+        prompt = self.prompts.resolve(parsed_event['invokeruid'])
+        if prompt is None:
+            return None
+        self.logger.debug(f"Prompt received event: {parsed_event}.")
+        self.targetmode = parsed_event['targetmode']
+        reply_targetmode.set(parsed_event['targetmode'])
+        sender = Sender(sender_name=parsed_event['invokername'], sender_uid=parsed_event['invokeruid'])
+        return prompt.callback, sender, [parsed_event['msg'].strip()], prompt.slow
+
+    def handle(self, event: TS3Event):
+        func, sender, args, slow = self.take_prompt(event) or self.parse_command(event)
+        if func is None:
+            return
+        if slow:
+            # 耗时指令交给线程池，同一用户的耗时指令按顺序执行
+            self.workers.submit(sender.sender_uid, self.run_command, func, sender, args)
+            return
+        self.run_command(func, sender, args)
+        return
+
+    async def handle_async(self, event: TS3Event):
+        try:
+            func, sender, args, slow = self.take_prompt(event) or self.parse_command(event)
+            if func is None:
                 return
-            self.logger.info(f"Exec cmd_function: {func.__name__}, sender: {sender}, args: {args}.")
+            if asyncio.iscoroutinefunction(func):
+                await func(sender, *args)
+            elif slow:
+                self.workers.submit(sender.sender_uid, self.run_command, func, sender, args)
+            else:
+                await asyncio.to_thread(func, sender, *args)
+        except Exception:
+            self.logger.error(f"Handle error: {traceback.format_exc()}")
+        finally:
+            self.last_command_time = time.time()
+            # 指令可能改变了播放状态，尽快核对一次
+            self.scheduler.poke()
+
+    def run_command(self, func, sender: Sender, args: List[str]):
+        if asyncio.iscoroutinefunction(func):
+            asyncio.run(func(sender, *args))
+        else:
             func(sender, *args)
-            return
+        self.last_command_time = time.time()
+        # 指令可能改变了播放状态，尽快核对一次
+        self.scheduler.poke()
+
+    def on_worker_error(self, e: BaseException):
+        self.logger.error(f"Worker error: {''.join(traceback.format_exception(e))}")
+        self.error("指令执行出错，请重试。")
 
     def send(self, msg: str, color: str = None, bold: bool = False):
-        if int(self.targetmode) == 3:
+        targetmode = reply_targetmode.get() or self.targetmode
+        if int(targetmode) == 3:
             target = self.sid
         else:
             target = self.cid
@@ -339,7 +746,13 @@ class TS3Bot:
             message = f"[color={color}]" + msg + "[/color]"
         if bold:
             message = f"[b]{message}[/b]"
-        self.conn.sendtextmessage(targetmode=self.targetmode, target=target, msg=message)
+        self.outbox.put(targetmode, target, message)
+
+    def deliver(self, targetmode, target, message: str):
+        self.conn.sendtextmessage(targetmode=targetmode, target=target, msg=message)
+
+    def on_send_error(self, e: BaseException):
+        self.logger.error(f"Send error: {''.join(traceback.format_exception(e))}")
 
     def success(self, msg: str):
         self.send(msg, color='green', bold=True)
@@ -355,27 +768,137 @@ class TS3Bot:
 
     def play_song(self, song: Song):
         self.logger.info(f"Play {song}")
-        link = self.music_api.get_song_link(song.id).data
+        link = self.router.get_song_link(song.id, source=song.source).data
+        link = self.local_link(song, link)
         singers = ' '.join(singer.name for singer in song.singers)
         name = song.name
-        response = self.audio_bot_api.play(link)
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        self.music_api.current_insert(song)
+        with self.playback_lock:
+            response = self.start_link(link)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.music_api.current_insert(song)
+        self.schedule_prefetch()
         self.success(f"！！开始播放来自{singers}的{name}")
         return
 
-    def add_song(self, list_id: str, song: Song):
-        self.logger.info(f"Add {song}")
-        singers = ' '.join(singer.name for singer in song.singers)
-        name = song.name
-        response = self.music_api.list_add(list_id, song)
-        if not response.succeed:
-            self.error(response.reason)
+    @staticmethod
+    def split_keys(keys: str) -> List[str]:
+        keys = keys.replace(',', '|').replace('，', '|')
+        return [key.strip() for key in keys.split('|') if key.strip()]
+
+    def search_keys(self, keys: List[str]) -> List[Tuple[Union[Song, None], Union[str, None]]]:
+        """ 并发搜索多个关键词，按输入顺序返回(第一首结果, 失败原因)，没搜到时两者都为None """
+        def search(key: str):
+            response = self.router.search_songs(key, size=1)
+            if not response.succeed:
+                return None, response.reason
+            if not response.data:
+                return None, None
+            return response.data[0], None
+        with ThreadPoolExecutor(max_workers=min(self.bulk_concurrency, len(keys)), thread_name_prefix="bulk") as executor:
+            return list(executor.map(search, keys))
+
+    def add_keys(self, list_id: str, keys: str):
+        """ 批量添加：一次写入歌单，一条消息汇总结果 """
+        keys = self.split_keys(keys)
+        if not keys:
+            return
+        results = self.search_keys(keys)
+        failed = {key: reason for key, (song, reason) in zip(keys, results) if reason is not None}
+        missing = [key for key, (song, reason) in zip(keys, results) if song is None and reason is None]
+        if len(keys) == 1 and failed:
+            self.error(f"搜索失败：{failed[keys[0]]}")
+            return
+        if len(keys) == 1 and missing:
+            # 只有一个关键词时保留搜索建议
+            response = self.router.get_suggest(keys[0])
+            if response.succeed and response.data:
+                self.info(f"没有搜到{keys[0]}哦，建议你搜搜[b]{'，'.join(response.data)}[b]")
+            else:
+                self.info("没有找到你想要的歌曲。")
             return
-        self.success(f"！！添加{singers}的{name}到歌单。")
-        return
+        self.add_songs(list_id, [song for song, _ in results if song is not None], missing, failed)
+
+    def resolve_ids(self, song_ids: List[str]) -> List[Tuple[Union[Song, None], Union[str, None]]]:
+        """ 按id_batch_size分批并发请求get_songs，按输入顺序返回(歌曲, 失败原因)，没找到时两者都为None """
+        chunks = [song_ids[i:i + self.id_batch_size] for i in range(0, len(song_ids), self.id_batch_size)]
+        def resolve(chunk: List[str]):
+            return chunk, self.router.get_songs(chunk)
+        found: Dict[str, Song] = {}
+        failed: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=min(self.bulk_concurrency, len(chunks)), thread_name_prefix="bulk") as executor:
+            for chunk, response in executor.map(resolve, chunks):
+                if not response.succeed:
+                    failed.update((song_id, response.reason) for song_id in chunk)
+                    continue
+                for song in response.data:
+                    found[song.id] = song
+        return [(found.get(song_id), None if song_id in found else failed.get(song_id)) for song_id in song_ids]
+
+    def add_ids(self, list_id: str, keys: str):
+        song_ids = [re.sub(r'\D', '', key) for key in self.split_keys(keys)]
+        song_ids = [song_id for song_id in song_ids if song_id]
+        if not song_ids:
+            self.warning("请跟上ID。")
+            return
+        results = self.resolve_ids(song_ids)
+        failed = {song_id: reason for song_id, (song, reason) in zip(song_ids, results) if reason is not None}
+        missing = [song_id for song_id, (song, reason) in zip(song_ids, results) if song is None and reason is None]
+        if len(song_ids) == 1 and failed:
+            self.error(f"获取歌曲失败：{failed[song_ids[0]]}")
+            return
+        if len(song_ids) == 1 and missing:
+            self.info("没有找到对应ID的歌曲。")
+            return
+        self.add_songs(list_id, [song for song, _ in results if song is not None], missing, failed)
+
+    def add_songs(self, list_id: str, songs: List[Song], missing: List[str], failed: Dict[str, str] = None):
+        # 检查本次重复点的歌和已在歌单中的歌，skip_queued开启时不再添加
+        seen = set()
+        repeated = []
+        queued = []
+        new_songs = []
+        for song in songs:
+            if song.id in seen:
+                repeated.append(song)
+            elif self.music_api.is_queued(song.id, list_id).data:
+                queued.append(song)
+            else:
+                new_songs.append(song)
+            seen.add(song.id)
+        if self.skip_queued:
+            songs = new_songs
+        if songs:
+            self.logger.info(f"Add {len(songs)} songs to {list_id}")
+            next_song = self.music_api.peek_next()
+            response = self.music_api.list_add(list_id, songs)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            if list_id == self.music_api.current_list_id:
+                self.check_next_changed(next_song)
+        infos = []
+        if len(songs) == 1:
+            song = songs[0]
+            infos.append(f"！！添加{' '.join(singer.name for singer in song.singers)}的{song.name}到歌单。")
+        elif songs:
+            infos.append(f"！！添加{len(songs)}首歌到歌单：")
+            for song in songs:
+                infos.append(f"{' '.join(singer.name for singer in song.singers)}的{song.name}")
+        skipped = "（已跳过）" if self.skip_queued else ""
+        if queued:
+            infos.append(f"已在歌单中{skipped}：{'，'.join(song.name for song in queued)}")
+        if repeated:
+            infos.append(f"本次重复点歌{skipped}：{'，'.join(song.name for song in repeated)}")
+        if missing:
+            infos.append(f"没有找到：{'，'.join(missing)}")
+        if failed:
+            infos.append(f"查询失败：{'，'.join(f'{key}（{reason}）' for key, reason in failed.items())}")
+        if songs:
+            self.success('\n'.join(infos))
+        else:
+            self.info('\n'.join(infos))
 
     def default(self, sender, *args):
         self.logger.info(f"Default sender: {sender}, args: {args}.")
@@ -395,31 +918,22 @@ class TS3Bot:
             return False
         return True
 
-    def confirm(self, sender: Sender, question: str, timeout: int = 5) -> bool:
-        message: str = self.ask(sender, question + "[是/否]", timeout=timeout)
-        if message.startswith("是"):
-            return True
-        return False
+    def confirm(self, sender: Sender, question: str, callback, timeout: int = 5, slow: bool = False):
+        """ 询问是否，回复后以callback(sender, bool)继续执行 """
+        def on_reply(sender: Sender, message: str):
+            return callback(sender, message.startswith("是"))
+
+        self.ask(sender, question + "[是/否]", on_reply, timeout=timeout, slow=slow)
 
-    def ask(self, sender: Sender, question: str, timeout: int = 10) -> str:
+    def ask(self, sender: Sender, question: str, callback, timeout: int = 10, slow: bool = False):
+        """
+        向用户提问后立即返回，不阻塞其他用户。
+        该用户的下一条消息会以callback(sender, message)继续执行，超时则提示未执行操作。
+        """
         self.logger.info(f"Ask sender:{sender}.")
         self.info(question + " >")
-        event = None
-        time_start = time.time()
-        while time.time() - time_start < timeout:
-            try:
-                event = self.wait_event(timeout=1)
-                if event.parsed[0]['invokeruid'] == sender.sender_uid:
-                    break
-            except TS3TimeoutError:
-                continue
-        if not event:
-            self.info("未执行操作。")
-            return ''
-        parsed_event = event.parsed[0]
-        self.logger.debug(f"Ask received event: {parsed_event}.")
-        message: str = parsed_event['msg']
-        return message.strip()
+        self.prompts.register(sender.sender_uid, Prompt(callback, lambda: self.info("未执行操作。"), slow=slow),
+                              timeout)
 
     def get_clid_from_uid(self, uid):
         ids = self.conn.clientgetids(cluid=uid)[0]
@@ -447,12 +961,39 @@ class TS3Bot:
         count = 1
         for api_id, api_info in sorted(self.music_apis.items(), key=lambda x: x[1]['priority'], reverse=True):
             api_info_str += f"[{count}]\tId: {api_id}\tApiType: {api_info['api'].__class__.__name__}\tPriority: {api_info['priority']}\tStatus: {'[color=green]Available[/color]' if api_info['accessibility'] else '[color=red]Unavailable[/color]'}\t"
+            if api_info['latency'] is not None:
+                api_info_str += f"Latency: {int(api_info['latency'] * 1000)}ms\t"
+            route_stats = self.router.stats(api_id)
+            if route_stats['error_rate'] > 0:
+                api_info_str += f"Errors: {int(route_stats['error_rate'] * 100)}%\t"
+            if route_stats['open']:
+                api_info_str += "[color=red]熔断中[/color]\t"
+            cache_stats = api_info['api'].cache_stats()
+            if cache_stats:
+                api_info_str += f"Cache: {cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}\t"
             if api_id == self.current_music_api:
                 api_info_str += "\t<=正在使用"
             api_info_str += '\n'
             count += 1
+        audio_stats = self.audio_bot_api.latency_stats()
+        api_info_str += f"AudioBot\tRequests: {audio_stats['count']}\tErrors: {audio_stats['errors']}\t" \
+                        f"Latency: {int(audio_stats['average'] * 1000)}ms (last {int(audio_stats['last'] * 1000)}ms)\n"
         self.send(api_info_str)
 
+    def cmd_show_cache(self, sender, *args):
+        if self.audio_cache is None and self.cover_cache is None:
+            self.info("本地缓存未开启。")
+            return
+        infos = []
+        mb = 1024 ** 2
+        for name, cache in (("歌曲缓存", self.audio_cache), ("封面缓存", self.cover_cache)):
+            if cache is None:
+                continue
+            stats = cache.stats()
+            infos.append(f"[b]{name}[/b]\t文件: {stats['files']}\t大小: {stats['size'] / mb:.1f}MB\t"
+                         f"命中率: {stats['hit_rate'] * 100:.1f}%\t节省流量: {stats['bytes_saved'] / mb:.1f}MB")
+        self.info('\n'.join(infos))
+
     def cmd_set_priority(self, sender, *args):
         if args[0] == '':
             self.send("请输入接口Id。")
@@ -525,13 +1066,13 @@ class TS3Bot:
             self.audio_bot_api.play()
             return
         self.info("正在搜索中....")
-        response = self.music_api.search_songs(args[0], size=1)
+        response = self.router.search_songs(args[0], size=1)
         if not response.succeed:
             self.error(response.reason)
             return
         songs = response.data
         if not songs:
-            response = self.music_api.get_suggest(args[0])
+            response = self.router.get_suggest(args[0])
             if not response.succeed:
                 self.error(response.reason)
             suggestions = response.data
@@ -551,7 +1092,7 @@ class TS3Bot:
             return
         self.info("正在搜索中....")
         song_id = re.sub(r'\D', '', args[0])
-        response = self.music_api.get_songs(song_id)
+        response = self.router.get_songs(song_id)
         if not response.succeed:
             self.error(response.reason)
             return
@@ -568,27 +1109,7 @@ class TS3Bot:
             self.audio_bot_api.play()
             return
         self.info("正在搜索中....")
-        keys: str = args[0]
-        keys = keys.replace(',', '|').replace('，', '|')
-        for key in keys.split('|'):
-            response = self.music_api.search_songs(key, size=1)
-            if not response.succeed:
-                self.error(response.reason)
-                return
-            songs = response.data
-            if not songs:
-                response = self.music_api.get_suggest(key)
-                if not response.succeed:
-                    self.error(response.reason)
-                suggestions = response.data
-                if suggestions:  # 如果suggest结果为非空则发送建议
-                    self.info(f"没有搜到{key}哦，建议你搜搜[b]{'，'.join(suggestions)}[b]")
-                    return
-                else:
-                    self.info("没有找到你想要的歌曲。")
-            else:
-                song = songs[0]
-                self.add_song(self.music_api.current_list_id, song)
+        self.add_keys(self.music_api.current_list_id, args[0])
         return
 
     def cmd_add_id(self, sender, *args):
@@ -596,20 +1117,7 @@ class TS3Bot:
             self.warning("请跟上ID。")
             return
         self.info("正在搜索中....")
-        keys: str = args[0]
-        keys = keys.replace(',', '|').replace('，', '|')
-        for key in keys.split('|'):
-            song_id = re.sub(r'\D', '', key)
-            response = self.music_api.get_songs(song_id)
-            if not response.succeed:
-                self.error(response.reason)
-                return
-            songs = response.data
-            if not songs:
-                self.info("没有找到对应ID的歌曲。")
-            else:
-                song = songs[0]
-                self.add_song(self.music_api.current_list_id, song)
+        self.add_ids(self.music_api.current_list_id, args[0])
         return
 
     def cmd_search(self, sender, *args):
@@ -624,13 +1132,13 @@ class TS3Bot:
                 keyword = ' '.join(args[:-1])
             except ValueError:
                 size = 20
-        response = self.music_api.search_songs(keyword, size=size)
+        response = self.router.search_songs(keyword, size=size)
         if not response.succeed:
             self.error(response.reason)
             return
         songs = response.data
         if not songs:
-            response = self.music_api.get_suggest(keyword)
+            response = self.router.get_suggest(keyword)
             if not response.succeed:
                 self.error(response.reason)
             suggestions = response.data
@@ -640,58 +1148,133 @@ class TS3Bot:
             else:
                 self.info("没有找到你想要的歌曲。")
         else:
-            infos = ["搜索到的结果如下内："]
-            for song in songs:
-                info_str = f"ID：{song.id}\t歌名：{song.name}\t歌手：{' '.join(singer.name for singer in song.singers)}"
-                if song.album:
-                    info_str += f"\t专辑：{song.album.name}"
-                infos.append(info_str)
-            self.info("[b]" + '\n'.join(infos) + "[/b]")
+            self.show_songs(sender, songs)
+
+    def show_songs(self, sender, songs: List[Song], show_source: bool = False):
+        """ 分页显示搜索结果 """
+        def render(start: int, end: int):
+            return [self.song_info(song, show_source) for song in songs[start:end]]
+
+        def title(page: int, pages: int, count: int):
+            return "搜索到的结果如下内：" if pages == 1 else f"搜索到的结果如下内（第{page}/{pages}页）："
+
+        self.info("[b]" + self.pager.show(sender.sender_uid, PageView(lambda: len(songs), render, title)) + "[/b]")
+
+    def cmd_search_all(self, sender, *args):
+        if args[0] == '':
+            return
+        self.info("正在搜索所有曲库....")
+        size = 20
+        keyword = ' '.join(args)
+        if len(args) >= 2:
+            try:
+                size = int(args[-1].strip())
+                keyword = ' '.join(args[:-1])
+            except ValueError:
+                size = 20
+        response = self.router.search_all(keyword, size=size, timeout=self.search_timeout)
+        if not response.succeed:
+            self.error(response.reason)
+            return
+        songs = response.data
+        if not songs:
+            self.info("没有找到你想要的歌曲。")
+            return
+        self.show_songs(sender, songs, show_source=True)
+
+    @staticmethod
+    def song_info(song: Song, show_source: bool = False) -> str:
+        info_str = f"ID：{song.id}\t歌名：{song.name}\t歌手：{' '.join(singer.name for singer in song.singers)}"
+        if song.album:
+            info_str += f"\t专辑：{song.album.name}"
+        if show_source and song.source:
+            info_str += f"\t来源：{song.source}"
+        return info_str
 
     def cmd_pause(self, sender, *args):
         self.audio_bot_api.pause()
 
+    def cmd_show_current(self, sender, *args):
+        # “当前歌单 2”为当前歌单的第2页
+        args = [arg for arg in args if arg != '']
+        self.show_list(sender, None, int(args[0]) if args and args[0].isdigit() else None)
+
     def cmd_show_list(self, sender, *args):
-        if args[0] == '':
+        # 单独的数字总是歌单ID，“歌单 123 2”为歌单123的第2页
+        args = [arg for arg in args if arg != '']
+        if not args:
+            self.show_list(sender, None, None)
+            return
+        self.show_list(sender, args[0], int(args[1]) if len(args) >= 2 and args[1].isdigit() else None)
+
+    def show_list(self, sender, list_id: Union[str, None], page: Union[int, None]):
+        """ list_id为None时显示当前歌单，page为None时显示默认页 """
+        if list_id is None:
             list_id = "当前"
             response = self.music_api.current_show()
         else:
-            list_id = args[0]
             response = self.music_api.list_show(list_id)
         if not response.succeed:
             self.error("未找到歌单ID请重试。")
             return
         playlist: PlayList = response.data
-        if list_id == "当前":
-            now_id = self.music_api.current_index
-        else:
-            now_id = -1
-        songs = playlist.songs
-        song_count = len(songs)
-        song_list_str = f"[b][color=blue]{list_id}歌单 共{song_count}首歌[/color]\n"
-        for index, song in enumerate(songs):
-            song_info_str = f"[{str(index + 1).zfill(len(str(song_count)))}]\tID：{song.id.ljust(9, '-')}  {song.name}  {'，'.join(singer.name for singer in song.singers)}"
-            if index == now_id:
-                song_info_str = "[color=green]" + song_info_str + " <==正在播放 [/color]"
-            song_list_str += song_info_str + '\n'
-        self.send(song_list_str)
+        is_current = list_id == "当前"
+        if page is None:
+            # 当前歌单默认显示正在播放的那一页
+            page = self.music_api.current_index // self.pager.page_size + 1 if is_current else 1
+
+        def count():
+            return len(playlist.songs)
+
+        def render(start: int, end: int):
+            songs = playlist.songs
+            width = len(str(len(songs)))
+            now_id = self.music_api.current_index if is_current else -1
+            lines = []
+            for index in range(start, end):
+                song = songs[index]
+                song_info_str = f"[{str(index + 1).zfill(width)}]\tID：{song.id.ljust(9, '-')}  {song.name}  {'，'.join(singer.name for singer in song.singers)}"
+                if index == now_id:
+                    song_info_str = "[color=green]" + song_info_str + " <==正在播放 [/color]"
+                lines.append(song_info_str)
+            return lines
+
+        def title(page: int, pages: int, song_count: int):
+            return f"[color=blue]{list_id}歌单 共{song_count}首歌 第{page}/{pages}页[/color]"
+
+        self.send("[b]" + self.pager.show(sender.sender_uid, PageView(count, render, title), page) + "[/b]")
         return
 
-    def cmd_next(self, sender, *args):
-        response = self.music_api.next()
-        if not response.succeed:
-            self.error(response.reason)
+    def cmd_next_page(self, sender, *args):
+        self.show_page(sender, 1)
+
+    def cmd_previous_page(self, sender, *args):
+        self.show_page(sender, -1)
+
+    def show_page(self, sender, delta: int):
+        text = self.pager.move(sender.sender_uid, delta)
+        if not text:
+            self.info("没有可以翻页的列表。")
             return
-        self.play_now()
+        self.send("[b]" + text + "[/b]")
+
+    def cmd_next(self, sender, *args):
+        with self.playback_lock:
+            response = self.music_api.next()
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.play_now()
         self.success("切换到歌单下一首。")
         return
 
     def cmd_previous(self, sender, *args):
-        response = self.music_api.previous()
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        self.play_now()
+        with self.playback_lock:
+            response = self.music_api.previous()
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.play_now()
         self.success("切换到歌单上一首。")
         return
 
@@ -703,11 +1286,13 @@ class TS3Bot:
         except ValueError:
             self.info("？跳转[索引]")
             return
-        response = self.music_api.jump(index)
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        self.play_now()
+        with self.playback_lock:
+            response = self.music_api.jump(index)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.drop_prefetch()
+            self.play_now()
         self.success(f"跳转到歌单第{index+1}首。")
         return
 
@@ -731,27 +1316,33 @@ class TS3Bot:
         return
 
     def cmd_clear(self, sender, *args):
-        confirm = self.confirm(sender, "你确定要清空当前歌单吗？")
-        if confirm:
-            response = self.music_api.clear()
-            if not response.succeed:
-                self.error("清空歌单失败。")
-                return
-            self.audio_bot_api.clear()
-            self.success("已为您清空歌单。")
-        else:
-            self.info("好的呢~")
+        def on_confirm(sender, confirm: bool):
+            if confirm:
+                response = self.music_api.clear()
+                if not response.succeed:
+                    self.error("清空歌单失败。")
+                    return
+                self.drop_prefetch()
+                self.audio_bot_api.clear()
+                self.success("已为您清空歌单。")
+            else:
+                self.info("好的呢~")
+            return
+
+        self.confirm(sender, "你确定要清空当前歌单吗？", on_confirm)
         return
 
     def cmd_play_list(self, sender, *args):
         if args[0] == '':
             self.info("请输入歌单ID。")
             return
-        response = self.music_api.list_play(args[0])
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        self.play_now()
+        with self.playback_lock:
+            response = self.music_api.list_play(args[0])
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.drop_prefetch()
+            self.play_now()
         self.success(f"！！开始播放歌单ID：{args[0]}")
         return
 
@@ -759,15 +1350,20 @@ class TS3Bot:
         if args[0] == '':
             self.info("请输入歌单ID。")
             return
-        confirm = self.confirm(sender, "你确定要删除该歌单吗？")
-        if not confirm:
-            self.info("好的呢~")
-            return
-        response = self.music_api.list_delete(args[0])
-        if not response.succeed:
-            self.error(response.reason)
+        list_id = args[0]
+
+        def on_confirm(sender, confirm: bool):
+            if not confirm:
+                self.info("好的呢~")
+                return
+            response = self.music_api.list_delete(list_id)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.success("已为您删除歌单。")
             return
-        self.success("已为您删除歌单。")
+
+        self.confirm(sender, "你确定要删除该歌单吗？", on_confirm)
         return
 
     def cmd_remove_item_list(self, sender, *args):
@@ -798,12 +1394,16 @@ class TS3Bot:
         except ValueError:
             self.error("参数不正确。")
             return
+        # 删除后播放位置会前移，需要先判断删除的是否为正在播放的歌曲
+        is_playing = index == self.music_api.current_index
         response = self.music_api.current_remove(index)
         if not response.succeed:
             self.error(response.reason)
             return
+        self.drop_prefetch()
         self.success("删除成功！")
-        if index == self.music_api.current_index:
+        if is_playing:
+            # 停止后update会切到下一首，也就是原来的后一首
             self.audio_bot_api.stop()
         return
 
@@ -824,29 +1424,7 @@ class TS3Bot:
             self.error("未找到歌单。")
             return
         self.info("正在搜索中....")
-        keys: str = args[1]
-        keys = keys.replace(',', '|').replace('，', '|')
-        for key in keys.split('|'):
-            response = self.music_api.search_songs(key, size=1)
-            if not response.succeed:
-                self.error(response.reason)
-                return
-            songs = response.data
-            if not songs:
-                response = self.music_api.get_suggest(key)
-                if not response.succeed:
-                    self.error(response.reason)
-                    return
-                suggestions = response.data
-                if suggestions:  # 如果suggest结果为非空则发送建议
-                    self.info(f"没有搜到{key}哦，建议你搜搜[b]{'，'.join(suggestions)}[b]")
-                    return
-                else:
-                    self.info("没有找到你想要的歌曲。")
-                    return
-            else:
-                song = songs[0]
-                self.add_song(list_id, song)
+        self.add_keys(list_id, args[1])
         return
 
     def cmd_add_id_item_list(self, sender, *args):
@@ -866,20 +1444,7 @@ class TS3Bot:
             self.error("未找到歌单。")
             return
         self.info("正在搜索中....")
-        keys: str = args[1]
-        keys = keys.replace(',', '|').replace('，', '|')
-        for key in keys.split('|'):
-            song_id = re.sub(r'\D', '', key)
-            response = self.music_api.get_songs(song_id)
-            if not response.succeed:
-                self.error(response.reason)
-                return
-            songs = response.data
-            if not songs:
-                self.info("没有找到对应ID的歌曲。")
-            else:
-                song = songs[0]
-                self.add_song(list_id, song)
+        self.add_ids(list_id, args[1])
         return
 
     def cmd_list_list(self, sender, *args):
@@ -887,27 +1452,35 @@ class TS3Bot:
         if not response.succeed:
             self.error(response.reason)
             return
-        lists: Dict[str, PlayList] = response.data
-        lists_info_str = "[b][color=blue]所有歌单[/color][/b]\n"
-        for playlist_id, playlist in lists.items():
-            lists_info_str += f"[b]ID：{playlist.id}\t歌曲数量：{len(playlist.songs)}[/b]\n"
-        self.send(lists_info_str)
+        lists: List[PlayList] = list(response.data.values())
+        page = int(args[0]) if args and args[0].isdigit() else 1
+
+        def render(start: int, end: int):
+            return [f"ID：{playlist.id}\t歌曲数量：{len(playlist.songs)}" for playlist in lists[start:end]]
+
+        def title(page: int, pages: int, count: int):
+            return f"[color=blue]所有歌单 共{count}个 第{page}/{pages}页[/color]"
+
+        self.send("[b]" + self.pager.show(sender.sender_uid, PageView(lambda: len(lists), render, title), page) + "[/b]")
         return
 
     def cmd_save_current_list(self, sender, *args):
-        list_id: str = self.ask(sender, "请输入要保存为的歌单名")
-        if not list_id:
-            return
-        response = self.music_api.list_create(list_id)
-        if not response.succeed:
-            self.error(response.reason)
-            return
-        response = self.music_api.list_copy(self.music_api.current_list_id, list_id)
-        if not response.succeed:
-            self.error(response.reason)
+        def on_reply(sender, list_id: str):
+            if not list_id:
+                return
+            response = self.music_api.list_create(list_id)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            response = self.music_api.list_copy(self.music_api.current_list_id, list_id)
+            if not response.succeed:
+                self.error(response.reason)
+                return
+            self.success(f"成功保存当前歌单到{list_id}歌单")
+            self.cmd_list_list(sender)
             return
-        self.success(f"成功保存当前歌单到{list_id}歌单")
-        self.cmd_list_list(sender)
+
+        self.ask(sender, "请输入要保存为的歌单名", on_reply)
         return
 
     def cmd_shuffle(self, sender, *args):
@@ -915,6 +1488,7 @@ class TS3Bot:
         if not response.succeed:
             self.error(response.reason)
             return
+        self.drop_prefetch()
         self.success("已打乱当前歌单。")
         return
 
@@ -925,20 +1499,27 @@ class TS3Bot:
     def cmd_pet_new(self, sender, *args):
         if not self.check_pet_api():
             return
-        if self.pet_api.have_pet(sender.sender_uid):
-            res = self.confirm(sender, "每个人只能创建一只宠物哦，是否要覆盖掉当前宠物？")
-            if not res:
+
+        def on_description(sender, msg: str):
+            if not msg:
+                return
+            self.info("生成中....")
+            pet_info: PetInfo = self.pet_api.new_pet(sender.sender_uid, msg)
+            if not pet_info:
+                self.error("创建宠物失败，请重试。")
+                return
+            self.success(f"创建宠物成功！恭喜{sender.sender_name}拥有了一只{pet_info.name}。")
+
+        def on_confirm(sender, confirm: bool):
+            if not confirm:
                 self.info("好的呢")
                 return
-        msg = self.ask(sender, "请输入宠物描述（15秒内）", timeout=15)
-        if not msg:
-            return
-        self.info("生成中....")
-        pet_info: PetInfo = self.pet_api.new_pet(sender.sender_uid, msg)
-        if not pet_info:
-            self.error("创建宠物失败，请重试。")
+            self.ask(sender, "请输入宠物描述（15秒内）", on_description, timeout=15, slow=True)
+
+        if self.pet_api.have_pet(sender.sender_uid):
+            self.confirm(sender, "每个人只能创建一只宠物哦，是否要覆盖掉当前宠物？", on_confirm)
             return
-        self.success(f"创建宠物成功！恭喜{sender.sender_name}拥有了一只{pet_info.name}。")
+        self.ask(sender, "请输入宠物描述（15秒内）", on_description, timeout=15, slow=True)
 
     def cmd_pet_upgrade(self, sender, *args):
         if not self.check_pet_api():
@@ -949,15 +1530,18 @@ class TS3Bot:
         if not self.pet_api.upgradable(sender.sender_uid):
             self.info("你的宠物目前还不能升级呢。")
             return
-        msg = self.ask(sender, "请输入技能描述（15秒内）", timeout=15)
-        if not msg:
-            return
-        self.info("生成技能中....")
-        skill = self.pet_api.upgrade_pet(sender.sender_uid, msg)
-        if not skill:
-            self.error("升级宠物失败，请重试。")
-            return
-        self.success(f"升级宠物成功！恭喜{sender.sender_name}的宠物获得了新技能{skill.name}。")
+
+        def on_description(sender, msg: str):
+            if not msg:
+                return
+            self.info("生成技能中....")
+            skill = self.pet_api.upgrade_pet(sender.sender_uid, msg)
+            if not skill:
+                self.error("升级宠物失败，请重试。")
+                return
+            self.success(f"升级宠物成功！恭喜{sender.sender_name}的宠物获得了新技能{skill.name}。")
+
+        self.ask(sender, "请输入技能描述（15秒内）", on_description, timeout=15, slow=True)
 
     def cmd_pet_list(self, sender, *args):
         if not self.check_pet_api():
@@ -1014,12 +1598,16 @@ class TS3Bot:
         if not self.pet_api.have_pet(sender.sender_uid):
             self.info("你还没有宠物呢。")
             return
-        confirm = self.confirm(sender, "你确定要删除你的宠物吗？")
-        if not confirm:
-            self.info("好的呢")
+
+        def on_confirm(sender, confirm: bool):
+            if not confirm:
+                self.info("好的呢")
+                return
+            self.pet_api.delete_pet(sender.sender_uid)
+            self.success("删除成功。")
             return
-        self.pet_api.delete_pet(sender.sender_uid)
-        self.success("删除成功。")
+
+        self.confirm(sender, "你确定要删除你的宠物吗？", on_confirm)
         return
 
     def cmd_pet_battle_start(self, sender, *args):
@@ -1038,7 +1626,6 @@ class TS3Bot:
             return
         self.success("[b]战斗开始！！！！！！！！！！！！！！")
         for r in res.rounds:
-            time.sleep(0.5)
             self.send('[b]' + r)
         self.success(f"最终赢家为：{self.get_name_from_uid(res.winner)}")
         return
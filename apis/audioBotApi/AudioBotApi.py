@@ -1,8 +1,14 @@
+import threading
+import time
 import urllib.parse
+from typing import Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from apis.BaseApi import BaseApiResponse
+from apis.audioBotApi.data import BotInfo, PlaybackState
 from apis.audioBotApi.exceptions import AudioBotApiException
 
 
@@ -25,9 +31,39 @@ def api(func):
 
 
 class AudioBotApi:
-    def __init__(self, url, bot_id=0):
+    def __init__(self, url, bot_id=0, connect_timeout: float = 3, read_timeout: float = 10, max_retries: int = 2,
+                 pool_size: int = 4, bot_info_ttl: float = 5):
         self.url = url
         self.bot_id = bot_id
+        # bot info client的快照，uid/clid/cid共用，过期或失效后重新获取。
+        self.bot_info_ttl = bot_info_ttl
+        self.bot_info: Union[BotInfo, None] = None
+        self.bot_info_lock = threading.Lock()
+        self.timeout = (connect_timeout, read_timeout)
+        # 复用同一个keep-alive会话，避免每次请求都重新建立TCP连接。
+        self.session = requests.Session()
+        # 添加、播放、切歌等指令虽然是GET但并不幂等，只重试请求未发出的连接失败，不重试读取超时和错误状态码。
+        retry = Retry(total=max_retries, connect=max_retries, read=0, status=0, other=0, backoff_factor=0.2,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 请求耗时统计
+        self.stats_lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+
+    def latency_stats(self) -> dict:
+        """ 返回exec的调用次数、失败次数以及平均/最近一次耗时（秒） """
+        with self.stats_lock:
+            average = self.total_latency / self.request_count if self.request_count else 0.0
+            return {"count": self.request_count, "errors": self.error_count,
+                    "average": average, "last": self.last_latency}
+
+    def close(self):
+        self.session.close()
 
     @api
     def exec(self, *args, encode_all=True):
@@ -39,14 +75,30 @@ class AudioBotApi:
         except Exception as e:
             return AudioBotApiResponse.failure("exec参数错误")
         url = self.url + f"/api/bot/use/{self.bot_id}/(/" + '/'.join(urlencoded_args)
-        rep = requests.get(url)
+        time_start = time.perf_counter()
+        try:
+            rep = self.session.get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self.record_latency(time.perf_counter() - time_start, failed=True)
+            raise
+        self.record_latency(time.perf_counter() - time_start)
         return AudioBotApiResponse.success(rep)
 
+    def record_latency(self, latency: float, failed: bool = False):
+        with self.stats_lock:
+            self.request_count += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            if failed:
+                self.error_count += 1
+
     # 无返回数据的api
 
     @api
     def add(self, link: str):
         response = self.exec("add", link)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code == 204:
             return AudioBotApiResponse.success()
@@ -57,6 +109,8 @@ class AudioBotApi:
     @api
     def list_add(self, list_id: str, link: str):
         response = self.exec("list", "add", list_id, link)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code == 204:
             return AudioBotApiResponse.success()
@@ -69,6 +123,8 @@ class AudioBotApi:
         if link is None:
             return AudioBotApiResponse.failure('链接获取失败')
         response = self.exec("play", link)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code == 204:
             return AudioBotApiResponse.success()
@@ -79,6 +135,8 @@ class AudioBotApi:
     @api
     def volume(self, value: str= ''):
         response = self.exec("volume", value)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code == 204:
             return AudioBotApiResponse.success()
@@ -90,6 +148,8 @@ class AudioBotApi:
     @api
     def pause(self):
         response = self.exec("pause")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -98,6 +158,8 @@ class AudioBotApi:
     @api
     def previous(self):
         response = self.exec("previous")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -106,6 +168,8 @@ class AudioBotApi:
     @api
     def next(self):
         response = self.exec("next")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -114,6 +178,8 @@ class AudioBotApi:
     @api
     def jump(self, index: int):
         response = self.exec("jump", str(index))
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -122,6 +188,8 @@ class AudioBotApi:
     @api
     def seek(self, position: float):
         response = self.exec("seek", str(position))
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -130,6 +198,8 @@ class AudioBotApi:
     @api
     def clear(self):
         response = self.exec("clear")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -138,6 +208,8 @@ class AudioBotApi:
     @api
     def stop(self):
         response = self.exec("stop")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -146,6 +218,8 @@ class AudioBotApi:
     @api
     def is_playing(self):
         response = self.exec("song")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code == 422 and rep.json()['ErrorCode'] == 10:
             return AudioBotApiResponse.success(False)
@@ -159,6 +233,8 @@ class AudioBotApi:
     @api
     def set_bot_avatar(self, link: str):
         response = self.exec("bot", "avatar", "set", link)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -167,6 +243,8 @@ class AudioBotApi:
     @api
     def set_bot_description(self, text: str):
         response = self.exec("bot", "description", "set", text)
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 204:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -177,46 +255,86 @@ class AudioBotApi:
     @api
     def get_song(self):
         response = self.exec("song")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 200:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
         return AudioBotApiResponse.success(rep.json())
 
+    @api
+    def get_playback_state(self):
+        """ 一次song请求同时得到是否在播放、链接、进度和时长 """
+        response = self.exec("song")
+        if not response.succeed:
+            return response
+        rep: requests.models.Response = response.data
+        if rep.status_code == 422 and rep.json()['ErrorCode'] == 10:
+            return AudioBotApiResponse.success(PlaybackState(playing=False))
+        if rep.status_code != 200:
+            return AudioBotApiResponse.failure("未能获取状态。")
+        data = rep.json()
+        length = float(data.get('Length') or 0.0)
+        return AudioBotApiResponse.success(PlaybackState(playing=length != 0.0, link=data.get('Link'),
+                                                         position=float(data.get('Position') or 0.0),
+                                                         length=length))
+
     @api
     def get_current(self):
         response = self.exec("song")
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 200:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
         return AudioBotApiResponse.success(rep.json())
 
+    @api
+    def get_bot_info(self, refresh: bool = False):
+        with self.bot_info_lock:
+            bot_info = self.bot_info
+            if not refresh and bot_info is not None and time.time() - bot_info.fetched_at < self.bot_info_ttl:
+                return AudioBotApiResponse.success(bot_info)
+            response = self.exec("bot", "info", "client")
+            if not response.succeed:
+                return response
+            rep: requests.models.Response = response.data
+            if rep.status_code != 200:
+                return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
+            data = rep.json()
+            self.bot_info = BotInfo(uid=data['Uid'], clid=data['Id'], cid=data['Channel'], fetched_at=time.time())
+            return AudioBotApiResponse.success(self.bot_info)
+
+    def invalidate_bot_info(self):
+        with self.bot_info_lock:
+            self.bot_info = None
+
     @api
     def get_uid(self):
-        response = self.exec("bot", "info", "client")
-        rep: requests.models.Response = response.data
-        if rep.status_code != 200:
-            return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
-        return AudioBotApiResponse.success(rep.json()['Uid'])
+        response = self.get_bot_info()
+        if not response.succeed:
+            return response
+        return AudioBotApiResponse.success(response.data.uid)
 
     @api
     def get_clid(self):
-        response = self.exec("bot", "info", "client")
-        rep: requests.models.Response = response.data
-        if rep.status_code != 200:
-            return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
-        return AudioBotApiResponse.success(rep.json()['Id'])
+        response = self.get_bot_info()
+        if not response.succeed:
+            return response
+        return AudioBotApiResponse.success(response.data.clid)
 
     @api
     def get_cid(self):
-        response = self.exec("bot", "info", "client")
-        rep: requests.models.Response = response.data
-        if rep.status_code != 200:
-            return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
-        return AudioBotApiResponse.success(rep.json()['Channel'])
+        response = self.get_bot_info()
+        if not response.succeed:
+            return response
+        return AudioBotApiResponse.success(response.data.cid)
 
     @api
     def get_list_ids(self):
         response = self.exec('list', 'list')
+        if not response.succeed:
+            return response
         rep: requests.models.Response = response.data
         if rep.status_code != 200:
             return AudioBotApiResponse.failure(f"状态码错误：{rep.status_code}")
@@ -0,0 +1,17 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class BotInfo(BaseModel):
+    uid: str
+    clid: int
+    cid: int
+    fetched_at: float = 0.0
+
+
+class PlaybackState(BaseModel):
+    playing: bool
+    link: Optional[str] = None
+    position: float = 0.0
+    length: float = 0.0
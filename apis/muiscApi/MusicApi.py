@@ -1,15 +1,16 @@
-import copy
-import json
-import os
+import atexit
 from abc import ABC, abstractmethod
 from urllib.parse import urlencode
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Tuple
 import requests
-import random
+import threading
 
 from apis.BaseApi import BaseApiResponse
-from apis.muiscApi.data import PlayList, Song, Album, Singer
+from apis.muiscApi.cache import ResultCache, cached
+from apis.muiscApi.compact import CompactPlayList, SongTable
+from apis.muiscApi.data import Song, Album, Singer
 from apis.muiscApi.exceptions import MusicApiException
+from apis.muiscApi.store import PlaylistStore, SqlitePlaylistStore
 
 
 class MusicApiResponse(BaseApiResponse):
@@ -28,40 +29,108 @@ def api(func):
     return wrapper
 
 class MusicApi(ABC):
-    def __init__(self, url):
+    # 查询结果的缓存时间（秒），子类可覆盖，0表示不缓存
+    cache_ttls: Dict[str, float] = {'search_songs': 600, 'get_suggest': 3600, 'get_songs': 3600}
+
+    def __init_subclass__(cls, **kwargs):
+        # 子类实现的查询方法自动套上缓存
+        super().__init_subclass__(**kwargs)
+        for name in MusicApi.cache_ttls:
+            if name in cls.__dict__:
+                setattr(cls, name, cached(name)(cls.__dict__[name]))
+
+    def __init__(self, url, store: PlaylistStore = None, write_behind_delay: float = 1.0, cache_size: int = 512):
         self.url = url
+        self.api_id = self.__class__.__name__  # 注册到TS3Bot时会改为注册的api id
+        self.catalog = self.__class__.__name__  # 曲库标识，同一曲库的接口歌曲id通用
+        self.result_cache = ResultCache(maxsize=cache_size) if cache_size > 0 else None
         self.playlists_path=f'./{self.__class__.__name__}_playlists.json'
         self.current_list_id = 'current'
-        self.current_index = -1
-        self.playlists:Dict[str,PlayList] = {}
+        # 歌单在内存中使用紧凑表示，对外的接口仍然返回Song和PlayList
+        self.song_table = SongTable()
+        self.playlists:Dict[str,CompactPlayList] = {}
+        self.lock = threading.RLock()  # 指令可能在多个线程中同时修改歌单
+        if store is None:
+            # 默认使用sqlite存储，首次启动时自动导入旧的json歌单文件
+            store = SqlitePlaylistStore(f'./{self.__class__.__name__}_playlists.db', migrate_from=self.playlists_path)
+        self.store = store
+        # 延迟写入：修改先记录在pending中，窗口期内的修改在一个事务中重放。设为0则每次修改立即写入（便于测试）。
+        self.write_behind_delay = write_behind_delay
+        self.pending: Dict[str, List[Tuple[str, tuple]]] = {}  # 歌单id -> 待写入的修改
+        self.flush_timer: Union[threading.Timer, None] = None
+        self.flush_lock = threading.Lock()
+        atexit.register(self.flush)
         self.init_playlists()
 
     def init_playlists(self):
-        if os.path.exists(self.playlists_path):
-            data = json.load(open(self.playlists_path))
-            for playlist_id,playlist in data.items():
-                self.playlists[playlist_id]=PlayList(**playlist)
-        else:
-            self.playlists = {}
+        self.playlists = self.store.load_compact(self.song_table)
         if self.current_list_id not in self.playlists.keys():
-            self.playlists[self.current_list_id] = PlayList(id=self.current_list_id, songs=[])
+            self.playlists[self.current_list_id] = CompactPlayList(self.current_list_id)
+            self.store.create(self.current_list_id)
         return
 
     def save_playlists(self):
-        # 尽量只在对list进行操作的接口中执行
-        data = {}
-        for playlist_id,playlist in self.playlists.items():
-            data[playlist_id] = json.loads(playlist.model_dump_json())
-        with open(self.playlists_path, 'w') as f:
-            f.write(json.dumps(data))
+        # 全量保存，歌单的修改接口只保存变化的部分
+        with self.flush_lock, self.lock:
+            self.pending = {}
+            self.store.save_all(self.playlists)
         return
 
+    def persist(self, list_id: str, operation: str, *args):
+        """ 对store的增量写入：operation为store的方法名，参数为list_id和args。延迟写入模式下先记录下来 """
+        if self.write_behind_delay <= 0:
+            getattr(self.store, operation)(list_id, *args)
+            return
+        with self.lock:
+            operations = self.pending.setdefault(list_id, [])
+            if operation in ('replace', 'delete'):
+                # 整个歌单被覆盖或删除，之前的修改不再需要写入
+                operations.clear()
+            operations.append((operation, (list_id, *args)))
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.write_behind_delay, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self):
+        """ 把积累的修改一次写入store，退出时也会自动执行 """
+        with self.flush_lock:
+            with self.lock:
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+                if not self.pending:
+                    return
+                operations = [operation for list_operations in self.pending.values() for operation in list_operations]
+                self.pending = {}
+            self.store.apply(operations)
+        return
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+    @property
+    def current_index(self) -> int:
+        # 播放位置保存在当前歌单中，插入删除歌曲时会自动调整
+        return self.playlists[self.current_list_id].songs.cursor
+
+    @current_index.setter
+    def current_index(self, index: int):
+        self.playlists[self.current_list_id].songs.cursor = index
+
+    def cache_stats(self) -> dict:
+        if self.result_cache is None:
+            return {}
+        return self.result_cache.stats()
+
     @api
     def list_create(self, list_id: str):
-        if list_id in self.playlists.keys():
-            return MusicApiResponse.failure("歌单Id已存在。")
-        self.playlists[list_id] = PlayList(id=list_id, songs=[])
-        self.save_playlists()
+        with self.lock:
+            if list_id in self.playlists.keys():
+                return MusicApiResponse.failure("歌单Id已存在。")
+            self.playlists[list_id] = CompactPlayList(list_id)
+            self.persist(list_id, 'create')
         return MusicApiResponse.success()
 
     @api
@@ -74,21 +143,23 @@ class MusicApi(ABC):
 
     @api
     def list_copy(self, list_src: str,list_dst: str):
-        if list_src not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        self.playlists[list_dst] = PlayList(id=list_dst,songs=self.playlists[list_src].songs)
-        self.save_playlists()
+        with self.lock:
+            if list_src not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            songs = list(self.playlists[list_src].songs)
+            self.playlists[list_dst] = CompactPlayList(list_dst, songs)
+            self.persist(list_dst, 'replace', songs)
         return MusicApiResponse.success()
 
     @api
     def list_show(self, list_id: str):
         if list_id not in self.playlists.keys():
             return MusicApiResponse.failure("歌单未找到。")
-        return MusicApiResponse.success(self.playlists[list_id])
+        return MusicApiResponse.success(self.playlists[list_id].view())
 
     @api
     def list_list(self):
-        tmp_playlists = copy.copy(self.playlists)
+        tmp_playlists = {list_id: playlist.view() for list_id, playlist in self.playlists.items()}
         tmp_playlists.pop(self.current_list_id)
         if len(tmp_playlists.keys()) == 0:
             return MusicApiResponse.failure("未创建任何歌单。")
@@ -96,50 +167,64 @@ class MusicApi(ABC):
 
     @api
     def list_delete(self, list_id: str):
-        if list_id not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        self.playlists.pop(list_id)
-        self.save_playlists()
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            self.playlists.pop(list_id)
+            self.persist(list_id, 'delete')
         return MusicApiResponse.success()
 
     @api
     def list_add(self, list_id: str, songs:Union[Song,List[Song]]):
-        if list_id not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        if type(songs) is Song:
-            songs = [songs]
-        self.playlists[list_id].songs+=songs
-        self.save_playlists()
-        return MusicApiResponse.success()
+        """ 返回添加的歌曲数 """
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            if type(songs) is Song:
+                songs = [songs]
+            playlist_songs = self.playlists[list_id].songs
+            songs = [self.song_table.compact(song) for song in songs]
+            start = len(playlist_songs)
+            playlist_songs.extend(songs)
+            self.persist(list_id, 'append', start, songs)
+        return MusicApiResponse.success(len(songs))
 
     @api
     def list_remove(self, list_id: str, index:int):
-        if list_id not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        try:
-            self.playlists[list_id].songs.pop(index)
-        except IndexError:
-            return MusicApiResponse.failure("索引超出范围。")
-        self.save_playlists()
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            songs = self.playlists[list_id].songs
+            if index < 0:
+                index += len(songs)
+            if index < 0 or index >= len(songs):
+                return MusicApiResponse.failure("索引超出范围。")
+            songs.pop(index)
+            self.persist(list_id, 'remove', index)
         return MusicApiResponse.success()
 
     @api
     def list_insert(self, list_id: str, index: int, song:Song):
-        if list_id not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        try:
-            self.playlists[list_id].songs.insert(index,song)
-        except IndexError:
-            return MusicApiResponse.failure("索引超出范围。")
-        self.save_playlists()
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            songs = self.playlists[list_id].songs
+            # 与list.insert一致：负数从末尾计算，超出范围则插入到两端
+            if index < 0:
+                index = max(index + len(songs), 0)
+            index = min(index, len(songs))
+            song = self.song_table.compact(song)
+            songs.insert(index,song)
+            self.persist(list_id, 'insert', index, song)
         return MusicApiResponse.success()
 
     @api
     def list_clear(self, list_id: str):
-        if list_id not in self.playlists.keys():
-            return MusicApiResponse.failure("歌单未找到。")
-        self.playlists[list_id].songs.clear()
-        self.save_playlists()
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            self.playlists[list_id].songs.clear()
+            self.persist(list_id, 'replace', [])
         return MusicApiResponse.success()
 
     @api
@@ -150,6 +235,22 @@ class MusicApi(ABC):
             return MusicApiResponse.success(True)
         return MusicApiResponse.success(False)
 
+    @api
+    def is_queued(self, song_id: str, list_id: str = None):
+        """ 歌曲是否已在歌单中，默认为当前歌单 """
+        list_id = self.current_list_id if list_id is None else list_id
+        if list_id not in self.playlists.keys():
+            return MusicApiResponse.failure("歌单未找到。")
+        return MusicApiResponse.success(song_id in self.playlists[list_id].songs)
+
+    @api
+    def list_positions(self, list_id: str, song_id: str):
+        """ 歌曲在歌单中的所有位置 """
+        with self.lock:
+            if list_id not in self.playlists.keys():
+                return MusicApiResponse.failure("歌单未找到。")
+            return MusicApiResponse.success(self.playlists[list_id].songs.index_of(song_id))
+
     @api
     def is_list_created(self, list_id: str):
         if list_id not in self.playlists.keys():
@@ -162,6 +263,11 @@ class MusicApi(ABC):
     def available(self):
         pass
 
+    @api
+    def health(self, timeout: float = 5):
+        """ 轻量的可用性探测，默认调用available，子类可以覆盖成更便宜的请求 """
+        return self.available()
+
     @api
     @abstractmethod
     def search_songs(self, key: str, size: int = 20, max_retries: int = 2):
@@ -189,7 +295,13 @@ class MusicApi(ABC):
 
     @api
     def current_insert(self,song:Song):
-        return self.list_insert(self.current_list_id, self.current_index, song)
+        """ 在当前位置插入歌曲，并把当前位置指向这首歌 """
+        with self.lock:
+            index = max(self.current_index, 0)
+            response = self.list_insert(self.current_list_id, index, song)
+            if response.succeed:
+                self.current_index = index
+            return response
 
     @api
     def current_add(self, song: Song):
@@ -218,6 +330,15 @@ class MusicApi(ABC):
         self.current_index = (self.current_index + 1) % len(self.playlists[self.current_list_id].songs)
         return self.now()
 
+    @api
+    def peek_next(self):
+        """ 返回下一首歌曲但不移动当前位置 """
+        with self.lock:
+            if self.is_current_empty().data:
+                return MusicApiResponse.failure("当前歌单为空。")
+            songs = self.playlists[self.current_list_id].songs
+            return MusicApiResponse.success(songs[(self.current_index + 1) % len(songs)].to_song())
+
     @api
     def previous(self):
         if self.is_current_empty().data:
@@ -245,13 +366,17 @@ class MusicApi(ABC):
             return MusicApiResponse.failure("当前歌单为空。")
         if self.current_index == -1 :
             return MusicApiResponse.failure("还未开始播放。")
-        return MusicApiResponse.success(self.playlists[self.current_list_id].songs[self.current_index])
+        return MusicApiResponse.success(self.playlists[self.current_list_id].songs[self.current_index].to_song())
 
     @api
     def shuffle(self):
         if self.is_current_empty().data:
             return MusicApiResponse.failure("当前歌单为空。")
-        random.shuffle(self.playlists[self.current_list_id].songs)
+        with self.lock:
+            songs = self.playlists[self.current_list_id].songs
+            songs.shuffle()
+            # 保存打乱后的副本，之后的修改在此基础上重放
+            self.persist(self.current_list_id, 'replace', list(songs))
         return MusicApiResponse.success()
 
 if __name__ == '__main__':
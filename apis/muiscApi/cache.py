@@ -0,0 +1,80 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+class ResultCache:
+    """
+    带过期时间的LRU缓存，条目数有上限，按方法统计命中和未命中次数。
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()  # key -> (过期时间, 结果)
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def get(self, method: str, key: str) -> Tuple[bool, Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits[method] = self.hits.get(method, 0) + 1
+                return True, entry[1]
+            if entry is not None:
+                self.entries.pop(key)
+            self.misses[method] = self.misses.get(method, 0) + 1
+            return False, None
+
+    def put(self, key: str, value: Any, ttl: float):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            return {"size": len(self.entries), "hits": hits, "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                    "methods": {method: {"hits": self.hits.get(method, 0), "misses": self.misses.get(method, 0)}
+                                for method in set(self.hits) | set(self.misses)}}
+
+
+def cached(name: str):
+    """
+    缓存MusicApi查询方法的成功结果，key包含api_id，不同曲库的结果互不干扰。
+    过期时间由实例的cache_ttls按方法名配置，调用时传入use_cache=False可跳过缓存。
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, use_cache: bool = True, **kwargs):
+            ttl = self.cache_ttls.get(name, 0)
+            if not use_cache or ttl <= 0 or self.result_cache is None:
+                return func(self, *args, **kwargs)
+            key = json.dumps([self.api_id, name, args, kwargs], sort_keys=True, ensure_ascii=False, default=str)
+            found, response = self.result_cache.get(name, key)
+            if not found:
+                response = func(self, *args, **kwargs)
+                if not response.succeed:
+                    return response
+                self.result_cache.put(key, response, ttl)
+            # 返回副本，避免调用方修改缓存中的列表
+            if isinstance(response.data, list):
+                return response.model_copy(update={'data': list(response.data)})
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,151 @@
+import json
+import sys
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Tuple
+
+from apis.muiscApi.data import Album, PlayList, Singer, Song
+from data_structures.IndexedSongList import IndexedSongList
+
+
+class CompactSong:
+    """
+    歌单中保存的歌曲，比pydantic的Song省内存。
+    歌手和专辑为(id, name)元组，由SongTable驻留，相同的歌手、歌手组合和专辑只保存一份。
+    """
+    __slots__ = ('id', 'name', 'singers', 'album', 'source')
+
+    def __init__(self, id: str, name: str, singers: Tuple[Tuple[str, str], ...],
+                 album: Optional[Tuple[str, str]] = None, source: Optional[str] = None):
+        self.id = id
+        self.name = name
+        self.singers = singers
+        self.album = album
+        self.source = source
+
+    def to_song(self) -> Song:
+        # 数据在转换为紧凑表示前已经校验过，这里跳过校验
+        return Song.model_construct(
+            id=self.id, name=self.name,
+            singers=[Singer.model_construct(name=name, id=singer_id) for singer_id, name in self.singers],
+            album=Album.model_construct(name=self.album[1], id=self.album[0]) if self.album else None,
+            source=self.source)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name,
+                "singers": [{"name": name, "id": singer_id} for singer_id, name in self.singers],
+                "album": {"name": self.album[1], "id": self.album[0]} if self.album else None,
+                "source": self.source}
+
+    def model_dump_json(self) -> str:
+        # 与Song.model_dump_json()的输出一致，存储可以不区分两种表示
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+class SongTable:
+    """ 歌手、歌手组合、专辑和来源的驻留表 """
+
+    def __init__(self):
+        self.singers: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.singer_groups: Dict[tuple, tuple] = {}
+        self.albums: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+    def intern_singers(self, singers) -> tuple:
+        group = tuple(self.singers.setdefault(singer, singer) for singer in singers)
+        return self.singer_groups.setdefault(group, group)
+
+    def intern_album(self, album: Optional[Tuple[str, str]]) -> Optional[Tuple[str, str]]:
+        if album is None:
+            return None
+        return self.albums.setdefault(album, album)
+
+    def compact(self, song: Song) -> CompactSong:
+        return CompactSong(song.id, song.name,
+                           self.intern_singers((singer.id, singer.name) for singer in song.singers),
+                           self.intern_album((song.album.id, song.album.name) if song.album else None),
+                           sys.intern(song.source) if song.source else None)
+
+    def from_dict(self, data: dict) -> CompactSong:
+        """ 直接从json数据生成，启动时不需要先构造pydantic模型 """
+        album = data.get('album')
+        source = data.get('source')
+        return CompactSong(str(data['id']), data['name'],
+                           self.intern_singers((str(singer['id']), singer['name']) for singer in data['singers']),
+                           self.intern_album((str(album['id']), album['name']) if album else None),
+                           sys.intern(source) if source else None)
+
+
+class SongView(Sequence):
+    """ 只读的歌曲列表，访问时才转换为Song，分页显示时只转换看到的部分 """
+
+    def __init__(self, songs: Sequence):
+        self.songs = songs
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [song.to_song() for song in self.songs[index]]
+        return self.songs[index].to_song()
+
+    def __len__(self):
+        return len(self.songs)
+
+
+class CompactPlayList:
+    __slots__ = ('id', 'songs')
+
+    def __init__(self, id: str, songs: List[CompactSong] = None):
+        self.id = id
+        # 带id索引和播放位置的列表
+        self.songs = IndexedSongList(songs)
+
+    @classmethod
+    def from_playlist(cls, playlist: PlayList, table: SongTable):
+        return cls(playlist.id, [table.compact(song) for song in playlist.songs])
+
+    def view(self) -> PlayList:
+        """ 对外返回PlayList，songs为按需转换的SongView """
+        return PlayList.model_construct(id=self.id, songs=SongView(self.songs))
+
+    def model_dump_json(self) -> str:
+        return '{"id":%s,"songs":[%s]}' % (json.dumps(self.id, ensure_ascii=False),
+                                           ','.join(song.model_dump_json() for song in self.songs))
+
+
+if __name__ == '__main__':
+    # 内存和加载时间对比：50000首歌，2000位歌手
+    # 在仓库根目录运行：python -m apis.muiscApi.compact
+    import random
+    import time
+    import tracemalloc
+
+    random.seed(0)
+    singers = [Singer(id=str(i), name=f"歌手{i}") for i in range(2000)]
+    rows = []
+    for i in range(50000):
+        song = Song(id=str(100000 + i), name=f"歌曲{i}", singers=random.sample(singers, random.choice([1, 1, 1, 2])),
+                    album=Album(id=str(i // 10), name=f"专辑{i // 10}"), source="default")
+        rows.append(song.model_dump_json())
+
+    def load_models():
+        return [Song.model_validate_json(row) for row in rows]
+
+    def load_compacts():
+        table = SongTable()
+        return [table.from_dict(json.loads(row)) for row in rows]
+
+    results = {}
+    for name, load in (("pydantic Song", load_models), ("CompactSong", load_compacts)):
+        start = time.perf_counter()
+        load()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        songs = load()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = (songs, memory, elapsed)
+    models, model_memory, model_time = results["pydantic Song"]
+    compacts, compact_memory, compact_time = results["CompactSong"]
+
+    assert all(compact.model_dump_json() == model.model_dump_json() for compact, model in zip(compacts[:100], models))
+    print(f"pydantic Song: {model_memory / 1024 ** 2:.1f}MB, load {model_time:.2f}s")
+    print(f"CompactSong:   {compact_memory / 1024 ** 2:.1f}MB, load {compact_time:.2f}s")
+    print(f"memory reduced by {(1 - compact_memory / model_memory) * 100:.0f}%")
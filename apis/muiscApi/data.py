@@ -15,6 +15,7 @@ class Song(BaseModel):
     name:str
     singers:List[Singer]
     album:Optional[Album]=None
+    source:Optional[str]=None  # 歌曲来自哪个接口（注册时的api id）
 
 class PlayList(BaseModel):
     id:str
@@ -1,2 +1,6 @@
 class MusicApiException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class PlaylistStoreException(MusicApiException):
+    pass
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Union
+
+from apis.muiscApi.MusicApi import MusicApi, MusicApiResponse
+from apis.muiscApi.data import Song
+
+
+class ApiHealth:
+    """ 单个接口的滚动统计和熔断状态 """
+
+    def __init__(self, window: int = 20):
+        self.records = deque(maxlen=window)  # (是否成功, 耗时)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record(self, succeed: bool, latency: float):
+        self.records.append((succeed, latency))
+        self.consecutive_failures = 0 if succeed else self.consecutive_failures + 1
+
+    def latency(self) -> Union[float, None]:
+        latencies = [latency for succeed, latency in self.records if succeed]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def error_rate(self) -> float:
+        if not self.records:
+            return 0.0
+        return sum(1 for succeed, _ in self.records if not succeed) / len(self.records)
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+
+class MusicApiRouter:
+    """
+    曲库查询的路由：按优先级依次尝试接口，失败时同一请求自动切到下一个接口。
+    连续失败failure_threshold次的接口熔断reset_timeout秒，到期后放行一次试探请求。
+    按id查询（歌曲、链接、封面）只会在同一曲库（MusicApi.catalog）的接口之间切换，保证id含义一致。
+    歌单仍由当前接口管理，不经过路由。
+    """
+    search_methods = ('search_songs', 'get_suggest')
+    id_methods = ('get_songs', 'get_song_link', 'get_avatar_link')
+
+    def __init__(self, music_apis: Dict[str, dict], current: Callable[[], Union[MusicApi, None]],
+                 failure_threshold: int = 3, reset_timeout: float = 30, window: int = 20):
+        self.music_apis = music_apis  # 与TS3Bot.music_apis共用
+        self.current = current
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self.lock = threading.Lock()
+        self.health: Dict[str, ApiHealth] = {}
+
+    def __getattr__(self, name):
+        if name in self.search_methods or name in self.id_methods:
+            def method(*args, source: str = None, **kwargs) -> MusicApiResponse:
+                return self.call(name, *args, source=source, **kwargs)
+            return method
+        raise AttributeError(name)
+
+    def get_health(self, api_id: str) -> ApiHealth:
+        with self.lock:
+            return self.get_health_locked(api_id)
+
+    def get_health_locked(self, api_id: str) -> ApiHealth:
+        if api_id not in self.health:
+            self.health[api_id] = ApiHealth(self.window)
+        return self.health[api_id]
+
+    def candidates(self, method: str, source: str = None) -> List[MusicApi]:
+        """ 本次请求依次尝试的接口：来源接口、当前接口，然后可用的按优先级，最后是探测不可用的 """
+        current = self.current()
+        ordered = sorted(self.music_apis.values(),
+                         key=lambda x: (x['id'] != source, x['api'] is not current, not x['accessibility'], -x['priority']))
+        apis = [api_info['api'] for api_info in ordered]
+        if current is not None and current not in apis:
+            # 未注册到music_apis的接口（直接传给TS3Bot的api）
+            apis.insert(0, current)
+        if method in self.id_methods:
+            anchor = self.music_apis[source]['api'] if source in self.music_apis else current
+            if anchor is not None:
+                apis = [api for api in apis if api.catalog == anchor.catalog]
+        return apis
+
+    def call(self, method: str, *args, source: str = None, **kwargs) -> MusicApiResponse:
+        response = MusicApiResponse.failure("NoAvailableApi")
+        for api in self.candidates(method, source):
+            api_id = api.api_id
+            health = self.get_health(api_id)
+            now = time.time()
+            with self.lock:
+                if health.is_open(now):
+                    continue
+                if health.consecutive_failures >= self.failure_threshold:
+                    # 半开：熔断到期，放行这一次请求，失败则再次熔断
+                    health.open_until = now + self.reset_timeout
+            response = getattr(api, method)(*args, **kwargs)
+            latency = time.time() - now
+            with self.lock:
+                health.record(response.succeed, latency)
+                if response.succeed:
+                    health.open_until = 0.0
+                elif health.consecutive_failures >= self.failure_threshold:
+                    health.open_until = time.time() + self.reset_timeout
+            if response.succeed:
+                self.stamp(response.data, api_id)
+                return response
+        return response
+
+    def search_all(self, key: str, size: int = 20, timeout: float = 5) -> MusicApiResponse:
+        """
+        同时在所有可用接口中搜索，timeout秒内返回的结果按接口优先级和响应时间排序，
+        歌名和歌手相同的歌曲只保留排在前面的一首。
+        """
+        now = time.time()
+        api_infos = [api_info for api_info in self.music_apis.values()
+                     if api_info['accessibility'] and not self.get_health(api_info['id']).is_open(now)]
+        if not api_infos:
+            return self.call('search_songs', key, size=size)
+
+        def search(api: MusicApi):
+            start = time.time()
+            response = api.search_songs(key, size=size)
+            latency = time.time() - start
+            with self.lock:
+                health = self.get_health_locked(api.api_id)
+                health.record(response.succeed, latency)
+                if not response.succeed and health.consecutive_failures >= self.failure_threshold:
+                    health.open_until = time.time() + self.reset_timeout
+            return response, latency
+
+        executor = ThreadPoolExecutor(max_workers=len(api_infos), thread_name_prefix="search")
+        futures = [(api_info, executor.submit(search, api_info['api'])) for api_info in api_infos]
+        wait([future for _, future in futures], timeout=timeout)
+        executor.shutdown(wait=False)
+        results = []
+        for api_info, future in futures:
+            if not future.done() or future.exception() is not None:
+                continue
+            response, latency = future.result()
+            if response.succeed:
+                results.append((api_info, latency, response.data))
+        if not results:
+            return MusicApiResponse.failure("NoAvailableApi")
+        results.sort(key=lambda x: (-x[0]['priority'], x[1]))
+        songs = []
+        seen = set()
+        for api_info, _, api_songs in results:
+            self.stamp(api_songs, api_info['id'])
+            for song in api_songs:
+                song_key = (song.name.strip().lower(), tuple(sorted(singer.name.strip().lower() for singer in song.singers)))
+                if song_key in seen:
+                    continue
+                seen.add(song_key)
+                songs.append(song)
+        return MusicApiResponse.success(songs[:size])
+
+    @staticmethod
+    def stamp(data, api_id: str):
+        """ 记录歌曲来自哪个接口，之后取链接时优先使用它 """
+        songs = data if isinstance(data, list) else [data]
+        for song in songs:
+            if isinstance(song, Song) and song.source is None:
+                song.source = api_id
+
+    def stats(self, api_id: str) -> dict:
+        health = self.get_health(api_id)
+        with self.lock:
+            return {'latency': health.latency(), 'error_rate': health.error_rate(),
+                    'open': health.is_open(time.time())}
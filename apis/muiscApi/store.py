@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from apis.muiscApi.compact import CompactPlayList, SongTable
+from apis.muiscApi.data import PlayList, Song
+from apis.muiscApi.exceptions import PlaylistStoreException
+
+
+class PlaylistStore(ABC):
+    """
+    歌单的持久化存储。MusicApi在内存中修改歌单后调用对应的方法，
+    每个方法只需要保存发生变化的部分。
+    传入的歌曲和歌单可能是紧凑表示（CompactSong、CompactPlayList），保存时只使用model_dump_json()。
+    """
+
+    @abstractmethod
+    def load(self) -> Dict[str, PlayList]:
+        pass
+
+    def load_compact(self, table: SongTable) -> Dict[str, CompactPlayList]:
+        """ 读取为紧凑表示，默认由load的结果原地转换 """
+        playlists = self.load()
+        for list_id, playlist in list(playlists.items()):
+            playlists[list_id] = CompactPlayList.from_playlist(playlist, table)
+        return playlists
+
+    @abstractmethod
+    def create(self, list_id: str):
+        pass
+
+    @abstractmethod
+    def delete(self, list_id: str):
+        pass
+
+    @abstractmethod
+    def append(self, list_id: str, start: int, songs: List[Song]):
+        pass
+
+    @abstractmethod
+    def insert(self, list_id: str, index: int, song: Song):
+        pass
+
+    @abstractmethod
+    def remove(self, list_id: str, index: int):
+        pass
+
+    @abstractmethod
+    def replace(self, list_id: str, songs: List[Song]):
+        # 整个歌单内容改变，比如复制、清空、打乱
+        pass
+
+    @abstractmethod
+    def save_all(self, playlists: Dict[str, PlayList]):
+        pass
+
+    def apply(self, operations: List[Tuple[str, tuple]]):
+        # 延迟写入时按顺序重放积累的修改，每项为(方法名, 参数)，如('append', (list_id, start, songs))
+        for name, args in operations:
+            getattr(self, name)(*args)
+
+    def close(self):
+        pass
+
+
+class JsonPlaylistStore(PlaylistStore):
+    """ 原先的json文件存储，任何修改都会重写整个文件 """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.playlists: Dict[str, PlayList] = {}
+
+    def load(self) -> Dict[str, PlayList]:
+        self.playlists = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            for playlist_id, playlist in data.items():
+                self.playlists[playlist_id] = PlayList(**playlist)
+        return self.playlists
+
+    def create(self, list_id: str):
+        self.save_all(self.playlists)
+
+    def delete(self, list_id: str):
+        self.save_all(self.playlists)
+
+    def append(self, list_id: str, start: int, songs: List[Song]):
+        self.save_all(self.playlists)
+
+    def insert(self, list_id: str, index: int, song: Song):
+        self.save_all(self.playlists)
+
+    def remove(self, list_id: str, index: int):
+        self.save_all(self.playlists)
+
+    def replace(self, list_id: str, songs: List[Song]):
+        self.save_all(self.playlists)
+
+    def save_all(self, playlists: Dict[str, PlayList]):
+        self.playlists = playlists
+        data = {}
+        for playlist_id, playlist in list(playlists.items()):
+            data[playlist_id] = json.loads(playlist.model_dump_json())
+        # 先写临时文件再替换，写入中途崩溃也不会损坏原文件
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def apply(self, operations: List[Tuple[str, tuple]]):
+        # 内存中的歌单已是最新，多个修改合并为一次写入
+        self.save_all(self.playlists)
+
+
+class SqlitePlaylistStore(PlaylistStore):
+    """
+    基于sqlite的歌单存储，每首歌一行，修改只涉及变化的行，每次修改在一个事务中完成。
+    migrate_from为旧的json歌单文件，数据库为空时会自动导入。
+    按位置的增量写入只适用于单个使用者，同一个数据库文件不能被多个store同时打开。
+    """
+    opened_paths = set()
+    opened_lock = threading.Lock()
+
+    def __init__(self, path: str, migrate_from: str = None):
+        self.path = path
+        self.real_path = os.path.realpath(path)
+        with SqlitePlaylistStore.opened_lock:
+            if self.real_path in SqlitePlaylistStore.opened_paths:
+                raise PlaylistStoreException(f"歌单数据库{path}已被其他api使用，请为每个api指定不同的store。")
+            SqlitePlaylistStore.opened_paths.add(self.real_path)
+        self.migrate_from = migrate_from
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS playlists (id TEXT PRIMARY KEY)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS songs ("
+                              "list_id TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS songs_list_position ON songs (list_id, position)")
+
+    def migrate(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM playlists").fetchone()[0]
+        if count == 0 and self.migrate_from and os.path.exists(self.migrate_from):
+            self.save_all(JsonPlaylistStore(self.migrate_from).load())
+
+    def load(self) -> Dict[str, PlayList]:
+        self.migrate()
+        playlists: Dict[str, PlayList] = {}
+        with self.lock:
+            for (list_id,) in self.conn.execute("SELECT id FROM playlists"):
+                playlists[list_id] = PlayList(id=list_id, songs=[])
+            for list_id, data in self.conn.execute("SELECT list_id, data FROM songs ORDER BY list_id, position"):
+                if list_id in playlists:
+                    playlists[list_id].songs.append(Song.model_validate_json(data))
+        return playlists
+
+    def load_compact(self, table: SongTable) -> Dict[str, CompactPlayList]:
+        # 直接解析json生成紧凑表示，不构造pydantic模型
+        self.migrate()
+        playlists: Dict[str, CompactPlayList] = {}
+        with self.lock:
+            for (list_id,) in self.conn.execute("SELECT id FROM playlists"):
+                playlists[list_id] = CompactPlayList(list_id)
+            for list_id, data in self.conn.execute("SELECT list_id, data FROM songs ORDER BY list_id, position"):
+                if list_id in playlists:
+                    playlists[list_id].songs.append(table.from_dict(json.loads(data)))
+        return playlists
+
+    def create(self, list_id: str):
+        with self.lock, self.conn:
+            self._create(list_id)
+
+    def delete(self, list_id: str):
+        with self.lock, self.conn:
+            self._delete(list_id)
+
+    def append(self, list_id: str, start: int, songs: List[Song]):
+        with self.lock, self.conn:
+            self._append(list_id, start, songs)
+
+    def insert(self, list_id: str, index: int, song: Song):
+        with self.lock, self.conn:
+            self._insert(list_id, index, song)
+
+    def remove(self, list_id: str, index: int):
+        with self.lock, self.conn:
+            self._remove(list_id, index)
+
+    def replace(self, list_id: str, songs: List[Song]):
+        with self.lock, self.conn:
+            self._replace(list_id, songs)
+
+    def apply(self, operations: List[Tuple[str, tuple]]):
+        # 所有修改在同一个事务中重放，只改动涉及的行
+        with self.lock, self.conn:
+            for name, args in operations:
+                getattr(self, '_' + name)(*args)
+
+    def save_all(self, playlists: Dict[str, PlayList]):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM songs")
+            self.conn.execute("DELETE FROM playlists")
+            for list_id, playlist in list(playlists.items()):
+                self._replace(list_id, playlist.songs)
+
+    def _create(self, list_id: str):
+        self.conn.execute("INSERT OR IGNORE INTO playlists (id) VALUES (?)", (list_id,))
+
+    def _delete(self, list_id: str):
+        self.conn.execute("DELETE FROM songs WHERE list_id = ?", (list_id,))
+        self.conn.execute("DELETE FROM playlists WHERE id = ?", (list_id,))
+
+    def _append(self, list_id: str, start: int, songs: List[Song]):
+        self.conn.executemany("INSERT INTO songs (list_id, position, data) VALUES (?, ?, ?)",
+                              [(list_id, start + i, song.model_dump_json()) for i, song in enumerate(songs)])
+
+    def _insert(self, list_id: str, index: int, song: Song):
+        self.conn.execute("UPDATE songs SET position = position + 1 WHERE list_id = ? AND position >= ?",
+                          (list_id, index))
+        self.conn.execute("INSERT INTO songs (list_id, position, data) VALUES (?, ?, ?)",
+                          (list_id, index, song.model_dump_json()))
+
+    def _remove(self, list_id: str, index: int):
+        self.conn.execute("DELETE FROM songs WHERE list_id = ? AND position = ?", (list_id, index))
+        self.conn.execute("UPDATE songs SET position = position - 1 WHERE list_id = ? AND position > ?",
+                          (list_id, index))
+
+    def _replace(self, list_id: str, songs: List[Song]):
+        self.conn.execute("INSERT OR IGNORE INTO playlists (id) VALUES (?)", (list_id,))
+        self.conn.execute("DELETE FROM songs WHERE list_id = ?", (list_id,))
+        self.conn.executemany("INSERT INTO songs (list_id, position, data) VALUES (?, ?, ?)",
+                              [(list_id, i, song.model_dump_json()) for i, song in enumerate(songs)])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        with SqlitePlaylistStore.opened_lock:
+            SqlitePlaylistStore.opened_paths.discard(self.real_path)
@@ -0,0 +1,38 @@
+from typing import Any, Dict, Tuple, Union
+
+
+class AliasTrie:
+    """
+    指令别名的前缀树，按最长匹配查找，耗时只和消息长度有关。
+    """
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+        self.size = 0
+
+    def insert(self, alias: str, value: Any) -> bool:
+        """ 插入别名，别名已存在时保留先注册的并返回False """
+        node = self.root
+        for char in alias:
+            node = node.setdefault(char, {})
+        if '' in node:
+            return False
+        # 空字符串不会作为单个字符出现，用来存放别名对应的值
+        node[''] = (alias, value)
+        self.size += 1
+        return True
+
+    def longest_prefix(self, text: str) -> Union[Tuple[str, Any], None]:
+        """ 返回text开头能匹配到的最长别名及其值 """
+        node = self.root
+        match = None
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if '' in node:
+                match = node['']
+        return match
+
+    def __len__(self):
+        return self.size
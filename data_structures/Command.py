@@ -7,4 +7,5 @@ class Command(BaseModel):
     command: str
     alias: List[str]
     help: str = ''
-    example: List[str] = []
\ No newline at end of file
+    example: List[str] = []
+    slow: bool = False  # 耗时指令在后台线程池中执行，不阻塞其他指令和播放
@@ -0,0 +1,130 @@
+import random
+from typing import Any, Dict, Iterable, List, Union
+
+
+class IndexedSongList:
+    """
+    歌单中的歌曲列表，维护歌曲id的计数和位置索引，以及当前播放位置cursor。
+    - 判断歌曲是否已在歌单中为O(1)；
+    - 位置索引在插入、删除后延迟重建，追加时增量维护；
+    - 插入、删除、打乱后cursor仍指向同一首歌，删除当前歌曲时指向前一首，下一首即为原来的后一首。
+    元素只需要有id属性。
+    """
+
+    def __init__(self, songs: Iterable[Any] = None):
+        self.songs: List[Any] = []
+        self.counts: Dict[str, int] = {}
+        self.positions: Union[Dict[str, List[int]], None] = {}
+        self.cursor = -1  # -1表示还未开始播放
+        if songs is not None:
+            self.extend(songs)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def __contains__(self, song_id: str) -> bool:
+        return song_id in self.counts
+
+    def count(self, song_id: str) -> int:
+        return self.counts.get(song_id, 0)
+
+    def index_of(self, song_id: str) -> List[int]:
+        """ 歌曲id在列表中的所有位置 """
+        if self.positions is None:
+            self.positions = {}
+            for index, song in enumerate(self.songs):
+                self.positions.setdefault(song.id, []).append(index)
+        return list(self.positions.get(song_id, []))
+
+    def _add(self, song_id: str):
+        self.counts[song_id] = self.counts.get(song_id, 0) + 1
+
+    def _discard(self, song_id: str):
+        count = self.counts[song_id] - 1
+        if count:
+            self.counts[song_id] = count
+        else:
+            del self.counts[song_id]
+
+    def append(self, song):
+        if self.positions is not None:
+            self.positions.setdefault(song.id, []).append(len(self.songs))
+        self.songs.append(song)
+        self._add(song.id)
+
+    def extend(self, songs: Iterable[Any]):
+        for song in songs:
+            self.append(song)
+
+    def insert(self, index: int, song):
+        """ index需已在[0, len]范围内，插入到当前歌曲之前（含当前位置）时cursor后移 """
+        self.songs.insert(index, song)
+        self._add(song.id)
+        self.positions = None
+        if 0 <= index <= self.cursor:
+            self.cursor += 1
+
+    def pop(self, index: int):
+        song = self.songs.pop(index)
+        self._discard(song.id)
+        self.positions = None
+        if index <= self.cursor:
+            # 删除当前歌曲时同样前移，下一首为原来的后一首
+            self.cursor -= 1
+        if not self.songs:
+            self.cursor = -1
+        return song
+
+    def clear(self):
+        self.songs.clear()
+        self.counts.clear()
+        self.positions = {}
+        self.cursor = -1
+
+    def shuffle(self):
+        """ 打乱顺序，cursor跟随当前歌曲 """
+        current = self.songs[self.cursor] if 0 <= self.cursor < len(self.songs) else None
+        random.shuffle(self.songs)
+        self.positions = None
+        if current is not None:
+            self.cursor = next(index for index, song in enumerate(self.songs) if song is current)
+
+
+if __name__ == '__main__':
+    # 100000首歌的歌单：查重、插入删除和cursor维护的耗时
+    # 在仓库根目录运行：python -m data_structures.IndexedSongList
+    import time
+    from types import SimpleNamespace
+
+    size = 100000
+    songs = [SimpleNamespace(id=str(i)) for i in range(size)]
+    queries = [str(random.randrange(size * 2)) for _ in range(1000)]
+
+    def bench(name, func):
+        start = time.perf_counter()
+        func()
+        print(f"{name}: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    plain = list(songs)
+    indexed = IndexedSongList(songs)
+    bench("build IndexedSongList", lambda: IndexedSongList(songs))
+    bench("1000 is-queued checks, list scan", lambda: [any(song.id == q for song in plain) for q in queries])
+    bench("1000 is-queued checks, indexed", lambda: [q in indexed for q in queries])
+
+    indexed.cursor = size // 2
+    current = indexed[indexed.cursor]
+
+    def churn():
+        for i in range(1000):
+            indexed.insert(random.randrange(len(indexed)), SimpleNamespace(id=f"new{i}"))
+            indexed.pop(random.randrange(len(indexed) // 4))
+
+    bench("1000 inserts + 1000 removes", churn)
+    assert indexed[indexed.cursor] is current or current.id not in indexed
+    bench("rebuild positions + 1000 lookups", lambda: [indexed.index_of(q) for q in queries])
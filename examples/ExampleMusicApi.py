@@ -4,14 +4,20 @@ import requests
 
 from apis.muiscApi.MusicApi import MusicApiResponse, MusicApi, api
 from apis.muiscApi.data import PlayList, Song, Album, Singer
+from apis.muiscApi.store import PlaylistStore, SqlitePlaylistStore
 
 
 
 class ExampleMusicApi(MusicApi):
 
-    def __init__(self,url,type):
+    def __init__(self,url,type,store:PlaylistStore=None):
         self.type = type
-        super().__init__(url)
+        if store is None:
+            # 不同type的实例各用一个数据库，旧的json歌单文件是同一个类共用的
+            store = SqlitePlaylistStore(f'./{self.__class__.__name__}_{type}_playlists.db',
+                                        migrate_from=f'./{self.__class__.__name__}_playlists.json')
+        super().__init__(url,store)
+        self.catalog = f"{self.__class__.__name__}:{type}"
 
     @staticmethod
     def _gen_song(song_data):
@@ -24,13 +30,22 @@ class ExampleMusicApi(MusicApi):
     # 以下api需要根据不同的api调整。
     @api
     def available(self):
-        response = self.search_songs("陈奕迅")
+        response = self.search_songs("陈奕迅", use_cache=False)
         if not response.succeed:
             return response
         if not response.data:
             return MusicApiResponse.failure("Unavailable")
         return MusicApiResponse.success()
 
+    @api
+    def health(self, timeout: float = 5):
+        # 只请求一次搜索建议，不走缓存也不重试
+        url = self.url + f"/api/music/{self.type}/searchsuggest"
+        rep = requests.get(url, params={"key": "a"}, timeout=timeout)
+        if rep.status_code != 200 or 'data' not in rep.json():
+            return MusicApiResponse.failure("Unavailable")
+        return MusicApiResponse.success()
+
     @api
     def search_songs(self, key: str, size: int = 20, max_retries: int = 2) -> MusicApiResponse:
         search_url = self.url + f"/api/music/{self.type}/search"
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import requests
+
+from utils.file_cache import CacheServer, FileCache
+
+
+class AudioCache:
+    """
+    歌曲的本地缓存：未命中时在后台下载，命中时返回内嵌HTTP服务上的地址交给AudioBot播放。
+    """
+    name = 'audio'
+
+    def __init__(self, directory: str = './cache/audio', max_bytes: int = 2 * 1024 ** 3,
+                 server: CacheServer = None, max_downloads: int = 2, timeout: float = 30):
+        self.cache = FileCache(directory, max_bytes)
+        self.server = server if server is not None else CacheServer()
+        self.server.mount(self.name, self.cache)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_downloads, thread_name_prefix="audio-cache")
+        self.downloading = set()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("TS3Bot")
+
+    def lookup(self, key: str, link: str) -> Union[str, None]:
+        """ 命中时返回本地地址，未命中时开始后台下载并返回None """
+        filename = FileCache.filename(key)
+        if self.cache.get(filename) is not None:
+            return self.server.url(self.name, filename)
+        self.prefetch(key, link)
+        return None
+
+    def prefetch(self, key: str, link: str):
+        """ 只下载不计入命中统计，用于预取下一首 """
+        filename = FileCache.filename(key)
+        with self.lock:
+            if filename in self.downloading or filename in self.cache:
+                return
+            self.downloading.add(filename)
+        self.executor.submit(self.download, filename, link)
+
+    def download(self, filename: str, link: str):
+        tmp_path = self.cache.tmp_path(filename)
+        try:
+            with requests.get(link, stream=True, timeout=self.timeout) as rep:
+                content_type = rep.headers.get('Content-Type', '')
+                if rep.status_code != 200 or content_type.startswith(('text/', 'application/json')):
+                    self.logger.info(f"Audio cache skipped {link}: {rep.status_code} {content_type}")
+                    return
+                with open(tmp_path, 'wb') as f:
+                    for chunk in rep.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            self.cache.commit(filename, tmp_path)
+        except Exception as e:
+            self.logger.info(f"Audio cache download failed {link}: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self.lock:
+                self.downloading.discard(filename)
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        with self.lock:
+            stats['downloading'] = len(self.downloading)
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,58 @@
+import select
+import threading
+import time
+
+from ts3.query import TS3Connection, TS3TimeoutError
+
+
+class LockedConnection:
+    """
+    TS3Connection不是线程安全的，这里给所有查询加锁。
+    wait_for_event在锁外等待socket可读，避免阻塞其他线程的查询。
+    """
+
+    def __init__(self, conn: TS3Connection, poll_interval: float = 0.5, read_timeout: float = 1):
+        self._conn = conn
+        self._lock = threading.RLock()
+        self._poll_interval = poll_interval
+        self._read_timeout = read_timeout
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return wrapper
+
+    def wait_for_event(self, timeout=None):
+        time_end = time.time() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                # 其他线程查询时可能已经把事件读进了队列或telnet缓冲区。
+                buffered = self._conn._event_queue or self._buffered()
+            if not buffered:
+                remaining = self._poll_interval
+                if time_end is not None:
+                    remaining = min(remaining, time_end - time.time())
+                    if remaining <= 0:
+                        raise TS3TimeoutError()
+                readable, _, _ = select.select([self._conn.fileno()], [], [], remaining)
+                if not readable:
+                    continue
+            with self._lock:
+                try:
+                    return self._conn.wait_for_event(timeout=self._read_timeout)
+                except TS3TimeoutError:
+                    pass
+
+    def _buffered(self) -> bool:
+        telnet_conn = self._conn.telnet_conn
+        return bool(telnet_conn.cookedq) or telnet_conn.irawq < len(telnet_conn.rawq)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Union
+
+import requests
+
+from utils.file_cache import CacheServer, FileCache
+
+try:
+    from PIL import Image
+except ImportError:  # 没有安装Pillow时不缩放，原样缓存
+    Image = None
+
+
+class CoverCache:
+    """
+    封面的本地缓存，按歌曲缓存缩放后的图片，通过内嵌HTTP服务交给AudioBot。
+    返回图片内容的哈希，图片没变时可以不再设置头像。未命中时在后台下载，不阻塞切歌。
+    """
+    name = 'cover'
+
+    def __init__(self, directory: str = './cache/cover', max_bytes: int = 100 * 1024 ** 2,
+                 server: CacheServer = None, size: int = 300, timeout: float = 10):
+        self.cache = FileCache(directory, max_bytes)
+        self.server = server if server is not None else CacheServer()
+        self.server.mount(self.name, self.cache)
+        self.size = size
+        self.timeout = timeout
+        self.digests: Dict[str, str] = {}  # 文件名 -> 图片哈希
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cover-cache")
+        self.downloading = set()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("TS3Bot")
+
+    @staticmethod
+    def filename(key: str) -> str:
+        return FileCache.filename(key, '.jpg' if Image is not None else '')
+
+    def get(self, key: str, link: str) -> Union[Tuple[str, str], None]:
+        """ 命中时返回(本地地址, 图片哈希)，未命中时开始后台下载并返回None """
+        filename = self.filename(key)
+        if self.cache.get(filename) is None:
+            self.prefetch(key, link)
+            return None
+        return self.server.url(self.name, filename), self.digest(filename)
+
+    def prefetch(self, key: str, link: str):
+        """ 在后台下载，已缓存或正在下载时直接返回 """
+        filename = self.filename(key)
+        with self.lock:
+            if not link or filename in self.downloading or filename in self.cache:
+                return
+            self.downloading.add(filename)
+        self.executor.submit(self.download, key, link)
+
+    def download(self, key: str, link: str):
+        try:
+            self.fetch(key, link)
+        finally:
+            with self.lock:
+                self.downloading.discard(self.filename(key))
+
+    def fetch(self, key: str, link: str) -> bool:
+        """ 同步下载并缓存封面，已缓存时直接返回，用于在后台线程中预取 """
+        filename = self.filename(key)
+        if filename in self.cache:
+            return True
+        if not link:
+            return False
+        try:
+            rep = requests.get(link, timeout=self.timeout)
+            if rep.status_code != 200 or not rep.headers.get('Content-Type', 'image/').startswith('image/'):
+                return False
+            data = self.resize(rep.content)
+        except Exception as e:
+            self.logger.info(f"Cover cache download failed {link}: {e}")
+            return False
+        with self.lock:
+            self.digests[filename] = hashlib.sha1(data).hexdigest()
+        self.cache.put(filename, data)
+        return True
+
+    def resize(self, data: bytes) -> bytes:
+        if Image is None:
+            return data
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail((self.size, self.size))
+        output = io.BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=90)
+        return output.getvalue()
+
+    def digest(self, filename: str) -> str:
+        with self.lock:
+            if filename in self.digests:
+                return self.digests[filename]
+        # 重启前缓存的文件
+        try:
+            with open(self.cache.path(filename), 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            digest = filename
+        with self.lock:
+            self.digests[filename] = digest
+        return digest
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Union
+from urllib.parse import quote, unquote
+
+
+class FileCache:
+    """
+    按key缓存文件的目录，总大小超过max_bytes时删除最久未使用的文件。
+    重启后会按修改时间恢复已有的缓存。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()  # 文件名 -> 大小，按使用顺序
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(directory, exist_ok=True)
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+        for entry in sorted(files, key=lambda x: x.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+        self.evict()
+
+    @staticmethod
+    def filename(key: str, suffix: str = '') -> str:
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + suffix
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def get(self, filename: str) -> Union[str, None]:
+        """ 命中时返回文件路径 """
+        with self.lock:
+            if filename not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            self.bytes_saved += self.entries[filename]
+            return self.path(filename)
+
+    def __contains__(self, filename: str) -> bool:
+        with self.lock:
+            return filename in self.entries
+
+    def tmp_path(self, filename: str) -> str:
+        return self.path(f"{filename}.{threading.get_ident()}.tmp")
+
+    def put(self, filename: str, data: bytes):
+        tmp_path = self.tmp_path(filename)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        self.commit(filename, tmp_path)
+
+    def commit(self, filename: str, tmp_path: str):
+        """ 把写好的临时文件放入缓存 """
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self.path(filename))
+        with self.lock:
+            self.size -= self.entries.pop(filename, 0)
+            self.entries[filename] = size
+            self.size += size
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            while self.size > self.max_bytes and self.entries:
+                filename, size = self.entries.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(self.path(filename))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"files": len(self.entries), "size": self.size, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0, "bytes_saved": self.bytes_saved}
+
+
+class CacheServer:
+    """
+    内嵌的HTTP服务，把缓存目录提供给AudioBot，地址为 http://<public_host>:<port>/<name>/<文件名>。
+    AudioBot不在本机时需要把public_host设为本机对它可见的地址，并把host设为对应网卡的地址（或'0.0.0.0'）。
+    服务没有鉴权，默认只监听本机。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, public_host: str = '127.0.0.1'):
+        self.caches: Dict[str, FileCache] = {}
+        caches = self.caches
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = unquote(self.path.split('?')[0]).strip('/').split('/')
+                if len(parts) != 2 or parts[0] not in caches or parts[1] not in caches[parts[0]]:
+                    self.send_error(404)
+                    return
+                path = caches[parts[0]].path(parts[1])
+                try:
+                    f = open(path, 'rb')
+                except OSError:
+                    self.send_error(404)
+                    return
+                with f:
+                    self.send_response(200)
+                    self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+                    self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                    self.end_headers()
+                    try:
+                        shutil.copyfileobj(f, self.wfile)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+
+            def log_message(self, format, *args):
+                logging.getLogger("TS3Bot").debug(f"CacheServer: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.public_host = public_host
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="cache-server", daemon=True)
+        self.thread.start()
+
+    def mount(self, name: str, cache: FileCache):
+        self.caches[name] = cache
+
+    def url(self, name: str, filename: str) -> str:
+        return f"http://{self.public_host}:{self.port}/{quote(name)}/{quote(filename)}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
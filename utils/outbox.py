@@ -0,0 +1,190 @@
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Union
+
+# TS3的文本消息超过1024个字符会被截断
+MESSAGE_LIMIT = 1024
+
+TAG_PATTERN = re.compile(r'(\[/?[a-zA-Z]+(?:=[^\[\]]*)?\])')
+
+
+def split_message(message: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    把过长的消息切成多段，优先在换行处切分，不会切断BBCode标签。
+    每段末尾补上未闭合的标签，下一段开头重新打开，保证每段单独显示（或与其他消息合并）时样式一致。
+    """
+    tokens = []
+    for token in TAG_PATTERN.split(message):
+        if not token:
+            continue
+        if TAG_PATTERN.fullmatch(token):
+            tokens.append(token)
+        else:
+            # 文本按行切开，换行留在行尾
+            tokens.extend(line for line in re.split(r'(?<=\n)', token) if line)
+    chunks = []
+    opened = []  # (标签名, 原始标签)
+
+    def reopen() -> str:
+        return ''.join(tag for _, tag in opened)
+
+    def closing() -> str:
+        return ''.join(f'[/{name}]' for name, _ in reversed(opened))
+
+    current = ''
+    line_start = None  # current中最后一个换行之后的位置，以及当时打开的标签
+
+    def flush():
+        nonlocal current, line_start
+        if TAG_PATTERN.sub('', current).strip():
+            chunks.append(current.rstrip('\n') + closing())
+        current = reopen()
+        line_start = None
+
+    def flush_lines() -> bool:
+        """ 在最后一个换行处结束当前段，未写完的行留到下一段 """
+        nonlocal current, line_start
+        if line_start is None:
+            return False
+        position, tags = line_start
+        head = current[:position]
+        if not TAG_PATTERN.sub('', head).strip():
+            return False
+        chunks.append(head.rstrip('\n') + ''.join(f'[/{name}]' for name, _ in reversed(tags)))
+        current = ''.join(tag for _, tag in tags) + current[position:]
+        line_start = None
+        return True
+
+    def overflow(extra: int) -> bool:
+        return len(current) + extra + len(closing()) > limit
+
+    for token in tokens:
+        if TAG_PATTERN.fullmatch(token):
+            if token.startswith('[/'):
+                name = token[2:-1].lower()
+                for i in range(len(opened) - 1, -1, -1):
+                    if opened[i][0] == name:
+                        opened.pop(i)
+                        current += token
+                        break
+                # 多余的闭合标签直接丢弃
+                continue
+            name = re.match(r'\[([a-zA-Z]+)', token).group(1).lower()
+            if overflow(len(token) + len(name) + 3):
+                flush_lines()
+            if overflow(len(token) + len(name) + 3):
+                flush()
+            current += token
+            opened.append((name, token))
+            continue
+        while token:
+            room = limit - len(current) - len(closing())
+            if len(token) <= room:
+                current += token
+                if token.endswith('\n'):
+                    line_start = (len(current), list(opened))
+                break
+            if current != reopen():
+                # 当前段已有内容，先在行边界处结束
+                if not flush_lines():
+                    flush()
+                continue
+            # 单行超长，只能硬切
+            current += token[:max(room, 1)]
+            token = token[max(room, 1):]
+            flush()
+    flush()
+    return chunks
+
+
+class TokenBucket:
+    """ 令牌桶：平均每秒rate条，允许burst条突发 """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Outbox:
+    """
+    发送消息的队列，由后台线程发送，调用方不需要等待。
+    发往同一目标的连续短消息会合并成一条，超长的消息会切分，发送速度受令牌桶限制以免触发服务器的防刷屏。
+    """
+
+    def __init__(self, deliver: Callable[[int, int, str], None], limit: int = MESSAGE_LIMIT,
+                 rate: float = 2, burst: int = 5, linger: float = 0.05,
+                 on_error: Union[Callable[[BaseException], None], None] = None):
+        self.deliver = deliver  # deliver(targetmode, target, msg)
+        self.limit = limit
+        self.bucket = TokenBucket(rate, burst)
+        self.linger = linger  # 等待后续消息以便合并的时间
+        self.on_error = on_error
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.sending = False
+        self.thread: Union[threading.Thread, None] = None
+
+    def put(self, targetmode, target, message: str):
+        with self.condition:
+            for chunk in split_message(message, self.limit):
+                self.queue.append((targetmode, target, chunk))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="outbox", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def take(self):
+        """ 取出下一条消息，并合并后面发往同一目标的消息 """
+        targetmode, target, message = self.queue.popleft()
+        while self.queue:
+            next_targetmode, next_target, next_message = self.queue[0]
+            if (next_targetmode, next_target) != (targetmode, target):
+                break
+            if len(message) + 1 + len(next_message) > self.limit:
+                break
+            message += '\n' + next_message
+            self.queue.popleft()
+        return targetmode, target, message
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.sending = False
+                    self.condition.notify_all()
+                    self.condition.wait()
+                self.sending = True
+            time.sleep(self.linger)
+            while True:
+                wait = self.bucket.wait_time()
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+            with self.condition:
+                targetmode, target, message = self.take()
+            self.bucket.take()
+            try:
+                self.deliver(targetmode, target, message)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+
+    def flush(self, timeout: float = None) -> bool:
+        """ 等待队列中的消息全部发出 """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.sending, timeout=timeout)
@@ -0,0 +1,47 @@
+import threading
+from typing import Callable, Dict, List, Tuple
+
+
+class PageView:
+    """
+    分页视图，只保存取数据的方法，翻页时按需渲染当前页。
+    count()返回总条数，render(start, end)返回这一段的每一行，title(page, pages, count)返回标题。
+    """
+
+    def __init__(self, count: Callable[[], int], render: Callable[[int, int], List[str]],
+                 title: Callable[[int, int, int], str]):
+        self.count = count
+        self.render = render
+        self.title = title
+
+
+class Pager:
+    """ 记录每个用户最近查看的视图和页码，用于“下一页”“上一页” """
+
+    def __init__(self, page_size: int = 20):
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.views: Dict[str, Tuple[PageView, int]] = {}
+
+    def pages(self, count: int) -> int:
+        return max((count + self.page_size - 1) // self.page_size, 1)
+
+    def show(self, uid: str, view: PageView, page: int = 1) -> str:
+        """ 渲染第page页（从1开始，超出范围时取最近的一页），并记为该用户的当前视图 """
+        count = view.count()
+        pages = self.pages(count)
+        page = min(max(page, 1), pages)
+        with self.lock:
+            self.views[uid] = (view, page)
+        start = (page - 1) * self.page_size
+        lines = [view.title(page, pages, count)]
+        lines.extend(view.render(start, min(start + self.page_size, count)))
+        return '\n'.join(lines)
+
+    def move(self, uid: str, delta: int) -> str:
+        """ 在该用户的当前视图中翻页，没有视图时返回空字符串 """
+        with self.lock:
+            if uid not in self.views:
+                return ''
+            view, page = self.views[uid]
+        return self.show(uid, view, page + delta)
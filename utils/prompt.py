@@ -0,0 +1,51 @@
+import contextvars
+import threading
+from typing import Callable, Dict, Union
+
+
+class Prompt:
+    def __init__(self, callback: Callable, on_timeout: Callable, slow: bool = False):
+        self.callback = callback
+        self.on_timeout = on_timeout
+        self.slow = slow
+        self.context = contextvars.copy_context()
+        self.timer: Union[threading.Timer, None] = None
+
+
+class PromptRegistry:
+    """
+    按用户uid登记等待回复的提问，用户的下一条消息交给对应的回调继续执行。
+    超时由定时器处理，不需要循环等待。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompts: Dict[str, Prompt] = {}
+
+    def register(self, uid: str, prompt: Prompt, timeout: float):
+        prompt.timer = threading.Timer(timeout, self._expire, args=(uid, prompt))
+        prompt.timer.daemon = True
+        with self.lock:
+            previous = self.prompts.get(uid)
+            self.prompts[uid] = prompt
+        if previous is not None:
+            previous.timer.cancel()
+        prompt.timer.start()
+
+    def resolve(self, uid: str) -> Union[Prompt, None]:
+        with self.lock:
+            prompt = self.prompts.pop(uid, None)
+        if prompt is not None:
+            prompt.timer.cancel()
+        return prompt
+
+    def __contains__(self, uid: str) -> bool:
+        with self.lock:
+            return uid in self.prompts
+
+    def _expire(self, uid: str, prompt: Prompt):
+        with self.lock:
+            if self.prompts.get(uid) is not prompt:
+                return
+            self.prompts.pop(uid)
+        prompt.context.run(prompt.on_timeout)
@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Callable, Union
+
+from apis.audioBotApi.data import PlaybackState
+
+
+class TrackEndScheduler:
+    """
+    根据当前歌曲的进度和时长推算下一次查询播放状态的时间。
+    快播完时在结束前后醒来切歌，其余时间低频轮询，手动停止、拖动进度最多延迟max_interval秒被发现。
+    """
+
+    def __init__(self, lead: float = 0.5, min_interval: float = 3, idle_interval: float = 15, max_interval: float = 30):
+        self.lead = lead  # 提前/延后于歌曲结束的时间
+        self.min_interval = min_interval  # 切歌等操作后留给AudioBot反应的时间
+        self.idle_interval = idle_interval  # 没有在播放时的轮询间隔
+        self.max_interval = max_interval  # 播放中的最长轮询间隔
+        self.lock = threading.Lock()
+        self.next_poll = 0.0
+        self.on_poke: Union[Callable[[], None], None] = None  # 提前查询时唤醒等待中的循环
+
+    def schedule(self, state: Union[PlaybackState, None], now: float = None) -> float:
+        """ 根据播放状态安排下一次查询，state为None表示查询失败 """
+        now = time.time() if now is None else now
+        if state is None or not state.playing:
+            delay = self.idle_interval
+        else:
+            remaining = state.length - state.position
+            if remaining > self.lead + self.min_interval:
+                # 在结束前醒来，再根据最新进度精确安排
+                delay = remaining - self.lead
+            else:
+                # 马上结束，结束后稍等一下再查询，保证AudioBot已经停下
+                delay = max(remaining, 0) + self.lead
+            delay = min(delay, self.max_interval)
+        with self.lock:
+            self.next_poll = now + delay
+            return self.next_poll
+
+    def poke(self, delay: float = None):
+        """ 播放状态可能被指令改变，提前查询 """
+        delay = self.min_interval if delay is None else delay
+        with self.lock:
+            self.next_poll = min(self.next_poll, time.time() + delay)
+        if self.on_poke is not None:
+            self.on_poke()
+
+    def due(self, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        return now >= self.next_poll
+
+    def wait_time(self, now: float = None) -> float:
+        now = time.time() if now is None else now
+        return max(self.next_poll - now, 0)
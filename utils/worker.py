@@ -0,0 +1,50 @@
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Union
+
+
+class KeyedWorkerPool:
+    """
+    有界线程池，同一个key（比如用户uid）提交的任务按顺序执行，不同key之间并发。
+    任务在提交时的上下文中执行，保证回复发到对应的消息来源。
+    """
+
+    def __init__(self, max_workers: int = 4, on_error: Union[Callable[[BaseException], None], None] = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="worker")
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.queues: Dict[str, Deque] = {}
+
+    def submit(self, key: str, fn: Callable, *args, **kwargs):
+        task = (contextvars.copy_context(), fn, args, kwargs)
+        with self.lock:
+            if key in self.queues:
+                # 该key已有任务在执行，排队等待
+                self.queues[key].append(task)
+                return
+            self.queues[key] = deque()
+        self.executor.submit(self._run, key, task)
+
+    def pending(self, key: str) -> int:
+        with self.lock:
+            return len(self.queues.get(key, ()))
+
+    def _run(self, key: str, task):
+        while True:
+            context, fn, args, kwargs = task
+            try:
+                context.run(fn, *args, **kwargs)
+            except Exception as e:
+                if self.on_error is not None:
+                    context.run(self.on_error, e)
+            with self.lock:
+                tasks = self.queues[key]
+                if not tasks:
+                    self.queues.pop(key)
+                    return
+                task = tasks.popleft()
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)